@@ -5,6 +5,7 @@ import sys
 # Analysis 
 import xarray as xr
 import numpy as np
+import transect_analysis as ta
 
 file_prepend = str(sys.argv[1])
 
@@ -16,7 +17,7 @@ tran_i = xr.open_dataset(
 )
 
 if not(sys.argv[2] in ['False', 'false', 'f', '0']):
-    tran_i = (tran_i - tran_i.rolling(time=24, center=True).mean()).dropna('time')
+    tran_i = ta.running_anomaly(tran_i, window=24).dropna('time')
     
 tran_i = tran_i.mean(dim='coastal_axis')
 
@@ -31,7 +32,7 @@ for i in range(13,14):
     )
     
     if not(sys.argv[2] in ['False', 'false', 'f', '0']):
-        tran_i = (tran_i - tran_i.rolling(time=24, center=True).mean()).dropna('time')
+        tran_i = ta.running_anomaly(tran_i, window=24).dropna('time')
         
     tran_i = tran_i.mean(dim='coastal_axis')
     
@@ -0,0 +1,274 @@
+# Core
+import argparse
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import random
+import re
+import urllib.parse
+
+# Networking
+import aiohttp
+
+from manifest import atomic_output
+
+url_list = 'subset_TRMM_3B42_V7_20190621_002105.txt'
+download_dir = '/g/data/w40/esh563/goulburn_NT/TRMM_3B42_download'
+
+# 3B42.YYYYMMDD.HH.<version>.HDF.nc4, the OPeNDAP subset of one 3 hourly file
+file_pattern = re.compile(r'(3B42\.(\d{8})\.(\d{2})\..*\.HDF\.nc4)$')
+
+# Responses worth retrying, besides connection errors and timeouts
+retry_status = {429, 500, 502, 503, 504}
+
+class DownloadError(Exception):
+    pass
+
+def read_url_list(path):
+    """
+    Return (url, file name, time) for every subset URL in a list, skipping other links such as the README.
+    """
+
+    entries = []
+    with open(path) as f:
+        for line in f:
+            url = line.strip()
+            match = file_pattern.search(urllib.parse.urlsplit(url).path)
+            if match is None:
+                continue
+            time = datetime.datetime.strptime(match.group(2) + match.group(3), '%Y%m%d%H')
+            entries.append((url, match.group(1), time))
+
+    return entries
+
+def select(entries, years=None, months=None, start=None, end=None):
+    """
+    Filter entries by year, month and an inclusive date range, leaving the list file untouched.
+    """
+
+    return [
+        (url, name, time) for url, name, time in entries
+        if (years is None or time.year in years)
+        and (months is None or time.month in months)
+        and (start is None or time.date() >= start)
+        and (end is None or time.date() <= end)
+    ]
+
+def replace_prefix(url, prefix):
+    """
+    Point a URL at another server, e.g. a local stand in for testing, keeping its path and query.
+    """
+
+    if prefix is None:
+        return url
+
+    parts = urllib.parse.urlsplit(url)
+
+    return prefix.rstrip('/') + parts.path + ('?' + parts.query if parts.query else '')
+
+def target_path(directory, name, time):
+    """
+    Return the path of a downloaded file in the year directory layout read by subset_TRMM_3B42.py.
+    """
+
+    return os.path.join(directory, str(time.year), name)
+
+def sha256(path):
+    """
+    Return the sha256 of a file.
+    """
+
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2 ** 20), b''):
+            h.update(block)
+
+    return h.hexdigest()
+
+def load_checksums(directory):
+    """
+    Return the recorded {relative path : {'size', 'sha256'}} of completed downloads.
+    """
+
+    path = os.path.join(directory, 'checksums.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_checksums(directory, checksums):
+    """
+    Write the checksums of completed downloads atomically.
+    """
+
+    path = os.path.join(directory, 'checksums.json')
+    with atomic_output(path) as tmp_path:
+        with open(tmp_path, 'w') as f:
+            json.dump(checksums, f, indent=1, sort_keys=True)
+
+def is_complete(path, record):
+    """
+    Check a downloaded file against its recorded size and sha256.
+    """
+
+    if record is None or not os.path.exists(path):
+        return False
+    if os.path.getsize(path) != record['size']:
+        return False
+
+    return sha256(path) == record['sha256']
+
+async def fetch(session, url, path, chunk_size=2 ** 16):
+    """
+    Download url to path, resuming from a partial file with a Range request.
+
+    The partial file is hashed before resuming so the checksum covers the
+    whole file. Returns the size and sha256 of the completed file.
+    """
+
+    part_path = path + '.part'
+    h = hashlib.sha256()
+    offset = 0
+    if os.path.exists(part_path):
+        with open(part_path, 'rb') as f:
+            for block in iter(lambda: f.read(2 ** 20), b''):
+                h.update(block)
+                offset += len(block)
+
+    headers = {'Range' : 'bytes={}-'.format(offset)} if offset > 0 else {}
+
+    async with session.get(url, headers=headers) as response:
+        if response.status == 416:
+            # A partial file already holding the whole resource only needs renaming
+            match = re.match(r'bytes \*/(\d+)$', response.headers.get('Content-Range', ''))
+            if match is not None and int(match.group(1)) == offset:
+                os.replace(part_path, path)
+                return {'size' : offset, 'sha256' : h.hexdigest()}
+            # Otherwise the partial file does not match the resource, start again
+            os.remove(part_path)
+            raise DownloadError('Range not satisfiable for {}'.format(url))
+        if response.status in retry_status:
+            raise aiohttp.ClientResponseError(
+                response.request_info, response.history, status=response.status, message=response.reason
+            )
+        response.raise_for_status()
+
+        # Servers that ignore Range send the whole file
+        if response.status != 206:
+            h = hashlib.sha256()
+            offset = 0
+        expected = response.content_length
+        if expected is not None:
+            expected += offset
+
+        with open(part_path, 'ab' if offset > 0 else 'wb') as f:
+            async for block in response.content.iter_chunked(chunk_size):
+                f.write(block)
+                h.update(block)
+                offset += len(block)
+
+    if expected is not None and offset != expected:
+        raise DownloadError('Received {} of {} bytes for {}'.format(offset, expected, url))
+
+    os.replace(part_path, path)
+
+    return {'size' : offset, 'sha256' : h.hexdigest()}
+
+async def fetch_with_retry(session, semaphore, url, path, retries=5, backoff=1.0):
+    """
+    Fetch with exponential backoff and jitter, holding one of the concurrency slots while downloading.
+    """
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    for attempt in range(retries + 1):
+        try:
+            async with semaphore:
+                return await fetch(session, url, path)
+        except aiohttp.ClientResponseError as e:
+            if e.status not in retry_status or attempt == retries:
+                raise
+        except (aiohttp.ClientError, asyncio.TimeoutError, DownloadError):
+            if attempt == retries:
+                raise
+        await asyncio.sleep(backoff * 2 ** attempt * (1 + random.random()))
+
+async def download(
+    entries, directory, concurrency=8, retries=5, backoff=1.0, prefix=None, timeout=600, save_every=50
+):
+    """
+    Download entries concurrently over one pooled session, returning the URLs that failed.
+
+    Files whose recorded checksum still matches are skipped. Credentials,
+    e.g. for Earthdata, are read from ~/.netrc.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    checksums = load_checksums(directory)
+    todo = []
+    for url, name, time in entries:
+        path = target_path(directory, name, time)
+        key = os.path.relpath(path, directory)
+        if not is_complete(path, checksums.get(key)):
+            todo.append((replace_prefix(url, prefix), path, key))
+
+    print('Downloading {} of {} files.'.format(len(todo), len(entries)))
+
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    failed = []
+
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=aiohttp.ClientTimeout(total=timeout), trust_env=True
+    ) as session:
+        tasks = {
+            asyncio.ensure_future(fetch_with_retry(session, semaphore, url, path, retries, backoff)) : (url, key)
+            for url, path, key in todo
+        }
+        pending = set(tasks)
+        completed = 0
+        while pending:
+            finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in finished:
+                url, key = tasks[task]
+                try:
+                    checksums[key] = task.result()
+                except Exception as e:
+                    print('Failed {}: {!r}'.format(url, e))
+                    failed.append(url)
+            completed += len(finished)
+
+            # Save progress now and then so an interrupted run skips finished files
+            if completed % save_every < len(finished) or not pending:
+                save_checksums(directory, checksums)
+                print('Completed {} of {} files.'.format(completed, len(todo)))
+
+    return failed
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Download TRMM 3B42 OPeNDAP subsets listed in a URL list.')
+    parser.add_argument('--urls', default=url_list, help='file with one URL per line')
+    parser.add_argument('--directory', default=download_dir, help='root of the year directories')
+    parser.add_argument('--years', nargs='+', type=int, default=None)
+    parser.add_argument('--months', nargs='+', type=int, default=None)
+    parser.add_argument('--start', type=parse_date, default=None, help='first date, YYYY-MM-DD')
+    parser.add_argument('--end', type=parse_date, default=None, help='last date, YYYY-MM-DD')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--retries', type=int, default=5)
+    parser.add_argument('--url-prefix', default=None, help='replace scheme and host, e.g. http://localhost:8000')
+    args = parser.parse_args()
+
+    entries = select(read_url_list(args.urls), args.years, args.months, args.start, args.end)
+
+    failed = asyncio.run(download(
+        entries, args.directory, concurrency=args.concurrency, retries=args.retries, prefix=args.url_prefix
+    ))
+
+    if failed:
+        raise SystemExit(1)
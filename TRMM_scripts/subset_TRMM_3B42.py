@@ -1,51 +1,108 @@
-# Core 
+# Core
+import calendar
+import concurrent.futures
 import datetime
 import os
-import glob
+import re
+import sys
 
 # HDF4 Support
 from pyhdf.SD import SD, SDC
 
-# Analysis 
+# Analysis
 import xarray as xr
 import numpy as np
 
-# Debugging 
-import pdb
-
 longitude = np.arange(-180 + .125, 180, 0.25)
 latitude = np.arange(-50 + .125, 50, 0.25)
 
+# Longitude 132.875 index is 1251, 136.125 index is 1264
+# Latitude -12.875 index is 148, -7.875 index is 168
+lon_slice = slice(1251, 1265)
+lat_slice = slice(148, 169)
+
 month = 11
-days = 30
-
-for i in range(5,15):
-    TRMM_list = [np.zeros((14,21))]*days*8
-    print('Calculating year 20{}'.format(str(i).zfill(2)), end='\r')
-    for j in range(1,days):
-        for k in range(0,24,3):
-            f_name = glob.glob(
-                '/g/data/ua8/NASA_TRMM/TRMM_L3/TRMM_3B42/20{0}/3B42.20{0}{3}{1}.{2}.*.HDF'.format(
-                    str(i).zfill(2), str(j).zfill(2), str(k).zfill(2), str(month).zfill(2)
-                )
-            )[0]
-            
-            # Longitude 132.875 index is 1251, 136.125 index is 1264
-            # Latitude -12.875 index is 148, -7.875 index is 168
-            TRMM_list[int((j-1)*8+k/3)] = SD(f_name, SDC.READ).select('precipitation')[1251:1265,148:169]
-    
-    TRMM = np.stack(TRMM_list, axis=-1)
-    base_time = datetime.datetime(2000+i, month, 1)
-    times = np.array([base_time + datetime.timedelta(hours=i) for i in range(0,24*days,3)])
-
-    coords = {'longitude' : longitude[1251:1265], 'latitude' : latitude[148:169], 'time' : times}
-    TRMM_da = xr.DataArray(TRMM, coords=coords, dims=['longitude', 'latitude', 'time'], name='precipitation')
+years = range(2005, 2015)
+
+TRMM_dir = '/g/data/ua8/NASA_TRMM/TRMM_L3/TRMM_3B42'
+save_dir = '/g/data/w40/esh563/goulburn_NT/TRMM_3B42'
+
+# 3B42.YYYYMMDD.HH.<version>.HDF, or .HDF.nc4 for OPeNDAP subsets from download_TRMM_3B42.py
+file_pattern = re.compile(r'3B42\.(\d{8})\.(\d{2})\..*\.HDF(\.nc4)?$')
+
+def index_year(year, directory=TRMM_dir):
+    """
+    Map (date, hour) to file path with a single listing of a year's directory.
+    """
+
+    files = {}
+    for name in sorted(os.listdir(directory + '/{}'.format(year))):
+        match = file_pattern.match(name)
+        if match is not None:
+            files.setdefault((match.group(1), int(match.group(2))), directory + '/{}/{}'.format(year, name))
+
+    return files
+
+def read_precipitation(path):
+    """
+    Read the Goulburn subset of precipitation from one HDF4 file or OPeNDAP subset.
+    """
+
+    if path.endswith('.nc4'):
+        # Subsets cover their own index range, so select by coordinate. Points
+        # outside the subset are NaN.
+        with xr.open_dataset(path) as ds:
+            precipitation = ds.precipitation.transpose('nlon', 'nlat').reindex(
+                nlon=longitude[lon_slice], nlat=latitude[lat_slice], method='nearest', tolerance=0.01
+            )
+            return precipitation.values.astype(np.float32)
+
+    sd = SD(path, SDC.READ)
+    precipitation = sd.select('precipitation')[lon_slice, lat_slice]
+    sd.end()
+
+    return precipitation
 
-    os.makedirs('/g/data/w40/esh563/goulburn_NT/TRMM_3B42', exist_ok=True)
-    save_path = '/g/data/w40/esh563/goulburn_NT/TRMM_3B42/TRMM_3B42_goulburn_20{}{}.nc'.format(
-        str(i).zfill(2), str(month).zfill(2)
+def subset_month(year, month, files, pool):
+    """
+    Read a month of 3 hourly files on a pool into a preallocated (longitude, latitude, time) array.
+    """
+
+    days = calendar.monthrange(year, month)[1]
+    base_time = datetime.datetime(year, month, 1)
+    times = np.array([base_time + datetime.timedelta(hours=h) for h in range(0, 24*days, 3)])
+
+    TRMM = np.full(
+        (lon_slice.stop - lon_slice.start, lat_slice.stop - lat_slice.start, times.size),
+        np.nan, dtype=np.float32
     )
-    
-    TRMM_da = TRMM_da.where(TRMM_da >= 0)
 
-    TRMM_da.to_netcdf(path=save_path, mode='w', format='NETCDF4')
+    paths = [files.get((t.strftime('%Y%m%d'), t.hour)) for t in times]
+    present = [i for i, path in enumerate(paths) if path is not None]
+    if len(present) < times.size:
+        print('Missing {} of {} files for {}-{}.'.format(times.size - len(present), times.size, year, str(month).zfill(2)))
+
+    for i, precipitation in zip(present, pool.map(read_precipitation, [paths[i] for i in present], chunksize=8)):
+        TRMM[:, :, i] = precipitation
+
+    coords = {'longitude' : longitude[lon_slice], 'latitude' : latitude[lat_slice], 'time' : times}
+    TRMM_da = xr.DataArray(TRMM, coords=coords, dims=['longitude', 'latitude', 'time'], name='precipitation')
+
+    return TRMM_da.where(TRMM_da >= 0)
+
+if __name__ == '__main__':
+
+    # Optionally read downloaded subsets, e.g. the download_TRMM_3B42.py directory, instead of TRMM_dir
+    source_dir = str(sys.argv[1]) if len(sys.argv) > 1 else TRMM_dir
+
+    os.makedirs(save_dir, exist_ok=True)
+
+    # HDF4 is not thread safe, so read on a process pool
+    with concurrent.futures.ProcessPoolExecutor() as pool:
+        for year in years:
+            print('Calculating year {}'.format(year))
+
+            TRMM_da = subset_month(year, month, index_year(year, source_dir), pool)
+
+            save_path = save_dir + '/TRMM_3B42_goulburn_{}{}.nc'.format(year, str(month).zfill(2))
+            TRMM_da.to_netcdf(path=save_path, mode='w', format='NETCDF4')
@@ -17,26 +17,13 @@ lat0 = -12.4715
 coast_lon1 = 133.3290
 coast_lat1 = -12.1468
 
-trans_lon0, trans_lat0, trans_lon1, trans_lat1, n_points, n_trans, coast_distances, tran_distances = ta.define_transects(
-    lon0, lat0, coast_lon1, coast_lat1, 453300
-)
-
-static_path = '/g/data/ua8/ARCCSS_Data/MCASClimate/v1-0/static/static.nc'
-static = xr.open_dataset(static_path).sel(latitude=slice(-12.75,-6), longitude=slice(130,139))
-static_tran = ta.calc_transects(static, trans_lon0, trans_lat0, trans_lon1, trans_lat1, n_points, n_trans) 
-static_tran = static_tran.assign_coords(coastal_axis = coast_distances)
-static_tran = static_tran.assign_coords(transect_axis = tran_distances)
-
-# Calcualate distance where landmask drops below 0.5
-coast_i = np.where(static_tran.mean('coastal_axis').LANDMASK.values < 0.5)[0][0] - 1
-coast_location = tran_distances[coast_i]
+# Interpolation weights and transect geometry are reused across runs
+cache_dir = '/g/data/w40/esh563/goulburn_NT/cache'
 
-# Redefine tran_distances so that coastline occurs at 0.
-tran_distances = tran_distances - coast_location
-
-# Create basis vectors of new coordinate system
-b_lon = trans_lon1[0] - lon0
-b_lat = trans_lat1[0] - lat0
+# Define transects, with the coastline at 0 along transect_axis
+geometry = ta.TransectGeometry.create(
+    lon0, lat0, coast_lon1, coast_lat1, 453300, cache_dir=cache_dir
+)
 
 # Iterate over all years
 for i in range(12, 15):
@@ -56,32 +43,23 @@ for i in range(12, 15):
     T_path = base + '/T/theta_goulburn_20{}12*.nc'.format(str(i).zfill(2))
     clouds_path = base + '/clouds_daily/clouds_goulburn_20{}12*.nc'.format(str(i).zfill(2))
 
-    #proj = (xr.open_mfdataset(U_path, chunks={'time': 744}).U * b_lon + xr.open_mfdataset(V_path, chunks={'time': 744}).V * b_lat)
-    #proj = proj / np.sqrt(b_lon ** 2 + b_lat ** 2)
+    #proj = geometry.project(xr.open_mfdataset(U_path, chunks={'time': ta.TIME_CHUNK}).U, xr.open_mfdataset(V_path, chunks={'time': ta.TIME_CHUNK}).V)
 
-    # PRCP = xr.open_mfdataset(PRCP_path, chunks={'time': 744}).RAINNC
+    # PRCP = xr.open_mfdataset(PRCP_path, chunks={'time': ta.TIME_CHUNK}).RAINNC
 
-    #proj_tran = ta.calc_transects(proj, trans_lon0, trans_lat0, trans_lon1, trans_lat1, n_points, n_trans)
-    #W_tran = ta.calc_transects(xr.open_mfdataset(W_path, chunks={'time': 744}).W, trans_lon0, trans_lat0, trans_lon1, trans_lat1, n_points, n_trans)
-    #PRCP_tran = ta.calc_transects(PRCP, trans_lon0, trans_lat0, trans_lon1, trans_lat1, n_points, n_trans)
-    #T_tran = ta.calc_transects(xr.open_mfdataset(T_path, chunks={'time': 744}).T, trans_lon0, trans_lat0, trans_lon1, trans_lat1, n_points, n_trans)
-    clouds_tran = ta.calc_transects(xr.open_mfdataset(clouds_path, concat_dim = 'time', chunks={'time': 744}), trans_lon0, trans_lat0, trans_lon1, trans_lat1, n_points, n_trans)
+    #proj_tran = geometry.calc_transects(proj)
+    #W_tran = geometry.calc_transects(xr.open_mfdataset(W_path, chunks={'time': ta.TIME_CHUNK}).W)
+    #PRCP_tran = geometry.calc_transects(PRCP)
+    #T_tran = geometry.calc_transects(xr.open_mfdataset(T_path, chunks={'time': ta.TIME_CHUNK}).T)
+    clouds_tran = geometry.calc_transects(xr.open_mfdataset(clouds_path, concat_dim = 'time', chunks={'time': ta.TIME_CHUNK}))
 
     z = np.loadtxt('average_model_levels.txt')[0:71]
     #proj_tran = proj_tran.assign_coords(level = z)\
-        #.assign_coords(coastal_axis = coast_distances)\
-        #.assign_coords(transect_axis = tran_distances)\
         #.rename('wind_proj')
     #W_tran = W_tran.assign_coords(level = z)\
-     #   .assign_coords(coastal_axis = coast_distances)\
-      #  .assign_coords(transect_axis = tran_distances)\
        # .rename('W')
-    #PRCP_tran = PRCP_tran.assign_coords(coastal_axis = coast_distances)\
-     #   .assign_coords(transect_axis = tran_distances)\
-      #  .rename('RAINNC')
-    clouds_tran = clouds_tran.assign_coords(level = z)\
-        .assign_coords(coastal_axis = coast_distances)\
-        .assign_coords(transect_axis = tran_distances)\
+    #PRCP_tran = PRCP_tran.rename('RAINNC')
+    clouds_tran = clouds_tran.assign_coords(level = z)
          
     save_path_proj = '/g/data/w40/esh563/goulburn_NT/transects/wind_proj_goulburn_20{}12_restricted.nc'.format(str(i).zfill(2))
     #save_path_W = '/g/data/w40/esh563/goulburn_NT/transects/W_goulburn_20{}12.nc'.format(str(i).zfill(2))
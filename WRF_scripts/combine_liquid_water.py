@@ -1,40 +1,144 @@
-# Core 
+# Core
+import argparse
+import concurrent.futures
 import glob
-import sys
 import os
+import traceback
 
-# Analysis 
+# Analysis
 import xarray as xr
 import numpy as np
-
-static_path = '/g/data/ua8/ARCCSS_Data/MCASClimate/v1-0/static/static.nc'
-static = xr.open_dataset(static_path).sel(latitude=slice(-12.5,-8), longitude=slice(133,136))
-z = np.loadtxt('average_model_levels.txt')[0:71]
+import transect_analysis as ta
+import storage
+from manifest import Manifest, atomic_output
 
 base_dir = '/g/data/w40/esh563/goulburn_NT'
+cache_dir = base_dir + '/cache'
+
+# Goulburn domain of the cropped cloud files
+region = {'latitude' : slice(-12.5, -8), 'longitude' : slice(133, 136)}
+
+dims = {'bottom_top' : 'level', 'south_north' : 'latitude', 'west_east' : 'longitude', 'Time' : 'time'}
+
+def resolve_coords():
+    """
+    Read the level, latitude and longitude coordinates once for every file.
+    """
+
+    static = ta.load_static(region, cache_dir)
+    z = np.loadtxt('average_model_levels.txt')[0:71]
+
+    return {'level' : z, 'latitude' : np.array(static.latitude), 'longitude' : np.array(static.longitude)}
+
+def open_clouds(load_path, coords, chunks=None):
+    """
+    Open hourly cropped cloud files as one dataset with named dimensions and coordinates.
+    """
+
+    cloud = xr.open_mfdataset(load_path, concat_dim = 'Time', combine = 'nested', chunks=chunks)
+    cloud = cloud.rename(dims)
+
+    return cloud.assign_coords(**coords)
+
+def convert_day(load_path, save_path, coords):
+    """
+    Convert one day of hourly files to a daily file.
+    """
+
+    cloud = open_clouds(load_path, coords)
+    with atomic_output(save_path) as tmp_path:
+        cloud.to_netcdf(path=tmp_path, mode='w', format='NETCDF4')
+
+    return save_path
+
+def convert_daily(year, coords, workers=1, force=False):
+    """
+    Convert each day of a December to a daily file, with days processed concurrently.
+    """
+
+    season = '{}{}'.format(year, year + 1)
+    save_base = base_dir + '/{}/clouds_daily'.format(season)
+    os.makedirs(save_base, exist_ok=True)
+    manifest = Manifest(save_base + '/manifest.json')
+    params = {'levels' : coords['level'].tolist()}
+
+    days = []
+    for day in range(1, 32):
+        load_path = base_dir + '/{}/clouds/clouds_goulburn_{}12{:02d}*.nc'.format(season, year, day)
+        save_path = save_base + '/clouds_goulburn_{}12{:02d}.nc'.format(year, day)
+
+        # Skip days whose hourly inputs have not changed since they were converted
+        inputs = sorted(glob.glob(load_path))
+        if inputs and (force or not manifest.is_current(save_path, inputs, params)):
+            days.append((load_path, save_path, inputs))
+
+    print('Converting {} days of {}.'.format(len(days), year))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(convert_day, load_path, save_path, coords) : (save_path, inputs)
+            for load_path, save_path, inputs in days
+        }
+        for future in concurrent.futures.as_completed(futures):
+            save_path, inputs = futures[future]
+            try:
+                future.result()
+                manifest.record(save_path, inputs, params)
+            except Exception:
+                traceback.print_exc()
+
+def monthly_path(year, store='zarr'):
+    """
+    Return the monthly cloud file or store of a December, as read by run_transects.py.
+    """
+
+    season = '{}{}'.format(year, year + 1)
 
-for i in range(5, 15):
+    return base_dir + '/{}/clouds_monthly/clouds_goulburn_{}12{}'.format(season, year, storage.store_suffix(store))
 
-    print('Calculating year 20{}'.format(str(i).zfill(2)))
-    save_base = base_dir + '/20{}20{}/clouds_daily'.format(str(i).zfill(2), str(i+1).zfill(2))
+def convert_monthly(year, coords, store='zarr', force=False):
+    """
+    Convert a whole December to a single monthly file or store in one pass.
+    """
+
+    season = '{}{}'.format(year, year + 1)
+    load_path = base_dir + '/{}/clouds/clouds_goulburn_{}12*.nc'.format(season, year)
+    save_path = monthly_path(year, store)
+    save_base = os.path.dirname(save_path)
     os.makedirs(save_base, exist_ok=True)
+    manifest = Manifest(save_base + '/manifest.json')
+    params = {'levels' : coords['level'].tolist(), 'store' : store}
+
+    # Skip months whose hourly inputs have not changed since they were converted
+    inputs = sorted(glob.glob(load_path))
+    if not inputs:
+        print('No hourly files for {}.'.format(year))
+        return
+    if not force and manifest.is_current(save_path, inputs, params):
+        print('Up to date {}.'.format(year))
+        return
+
+    print('Converting {}.'.format(year))
+
+    cloud = open_clouds(load_path, coords, chunks={'Time' : 24})
+    with atomic_output(save_path) as tmp_path:
+        storage.write_intermediate(cloud, tmp_path, store=store)
+    manifest.record(save_path, inputs, params)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Combine hourly cropped cloud files.')
+    parser.add_argument('--years', nargs='+', type=int, default=list(range(2005, 2015)))
+    parser.add_argument('--monthly', action='store_true', help='write one file or store per month instead of daily files')
+    parser.add_argument('--store', default='zarr', choices=storage.STORES, help='format of monthly output')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--force', action='store_true', help='convert days or months that are up to date')
+    args = parser.parse_args()
+
+    coords = resolve_coords()
 
-    for j in range(1, 32):
-
-        print('Caclulating day {}'.format(str(j).zfill(2)))
-
-        load_path = base_dir + '/20{0}20{1}/clouds/clouds_goulburn_20{0}12{2}*.nc'.format(
-            str(i).zfill(2), str(i+1).zfill(2), str(j).zfill(2)
-        )
-        cloud = xr.open_mfdataset(load_path, concat_dim = 'Time')
-        cloud = cloud.rename(
-            {'bottom_top' : 'level', 'south_north' : 'latitude', 'west_east' : 'longitude', 'Time' : 'time'}
-        )
-        cloud = cloud.assign_coords(level = z)
-        cloud = cloud.assign_coords(latitude = static.latitude)
-        cloud = cloud.assign_coords(longitude = static.longitude)
-
-        save_path = save_base + '/clouds_goulburn_20{0}12{2}.nc'.format(
-            str(i).zfill(2), str(i+1).zfill(2), str(j).zfill(2)
-        )
-        cloud.to_netcdf(path=save_path, mode='w', format='NETCDF4')
+    for year in args.years:
+        if args.monthly:
+            convert_monthly(year, coords, store=args.store, force=args.force)
+        else:
+            convert_daily(year, coords, workers=args.workers, force=args.force)
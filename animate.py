@@ -0,0 +1,254 @@
+# Core
+import argparse
+import concurrent.futures
+import datetime
+import os
+
+# Analysis
+import xarray as xr
+import numpy as np
+
+# Plotting
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib import rcParams
+import imageio
+
+import run_transects as rt
+
+means_dir = '/g/data/w40/esh563/goulburn_NT/transect_means'
+
+# Highest model level plotted
+max_level = 58
+
+# Figure built once in each pool worker by _init_worker
+_section = None
+
+def _remove_contours(contour_set):
+    """
+    Remove a filled or line contour set from its axes.
+    """
+
+    try:
+        contour_set.remove()
+    except AttributeError:
+        # Contour sets are not artists before matplotlib 3.8
+        for collection in contour_set.collections:
+            collection.remove()
+
+class CrossSection:
+    """
+    Transect cross section figure whose artists are updated in place for each frame.
+
+    The figure, colour bar, coast line and labels are drawn once. Each frame
+    redraws only the contours, which matplotlib cannot update, and updates
+    the quiver arrows and title text.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+
+        rcParams.update({'font.family' : 'serif'})
+        rcParams.update({'font.serif': 'Liberation Serif'})
+        rcParams.update({'mathtext.fontset' : 'dejavuserif'})
+        rcParams.update({'font.size': 12})
+
+        self.fig, self.ax = plt.subplots(figsize=spec['figsize'])
+        distance, level = spec['distance'], spec['level']
+
+        # Plot location of coastline
+        self.ax.plot([0, 0], [level[0], level[-1]], '--', color='grey')
+
+        self.shading = self._shade(0)
+        cbar = self.fig.colorbar(self.shading)
+        cbar.set_label(spec['label'])
+
+        self.contour = self._contour(0)
+        if self.contour is not None:
+            handles = self.contour.legend_elements()[0]
+            self.ax.legend(
+                handles, spec['contour_labels'], loc='upper center', ncol=2,
+                frameon=True, title=spec['contour_label']
+            )
+
+        self.quiver = None
+        if 'quiver' in spec:
+            q = spec['quiver']
+            self.quiver = self.ax.quiver(
+                q['distance'], q['level'], q['u'][0], q['v'][0],
+                units='xy', angles='xy', scale=q['scale']
+            )
+
+        self.title = self.ax.set_title('')
+        self.ax.set_xlabel('Distance [m]')
+        self.ax.set_ylabel('Height [m]')
+
+    def _shade(self, i):
+        spec = self.spec
+        return self.ax.contourf(
+            spec['distance'], spec['level'], spec['shading'][i], spec['levels'], cmap=spec['cmap']
+        )
+
+    def _contour(self, i):
+        spec = self.spec
+        if 'contour' not in spec:
+            return None
+
+        return self.ax.contour(
+            spec['distance'], spec['level'], spec['contour'][i], levels=spec['contour_levels'],
+            colors='black', linestyles=['dashed', 'solid'], linewidths=0.75
+        )
+
+    def draw(self, i):
+        """
+        Update every artist to frame i.
+        """
+
+        _remove_contours(self.shading)
+        self.shading = self._shade(i)
+
+        if self.contour is not None:
+            _remove_contours(self.contour)
+            self.contour = self._contour(i)
+
+        if self.quiver is not None:
+            self.quiver.set_UVC(self.spec['quiver']['u'][i], self.spec['quiver']['v'][i])
+
+        lst = self.spec['lst'][i]
+        self.title.set_text('{} \n {:02d}:{:02d} LST'.format(
+            self.spec['title'], int(lst), int(round((lst % 1) * 60)) % 60
+        ))
+
+def _init_worker(spec):
+    """
+    Build the figure once per worker.
+    """
+
+    global _section
+    _section = CrossSection(spec)
+
+def _render(i, path, dpi):
+    """
+    Draw frame i with the worker's figure and save it.
+    """
+
+    _section.draw(i)
+    _section.fig.savefig(path, dpi=dpi)
+
+    return path
+
+def local_solar_time(hour, lon_mean):
+    """
+    Local solar time in hours for UTC hours at a mean longitude.
+    """
+
+    return (np.asarray(hour) + (lon_mean / 360) * 24) % 24
+
+def velocity_spec(proj, W, lst):
+    """
+    Describe the perturbation velocity cross section: speed shading with wind arrows.
+    """
+
+    proj = proj.isel(level=slice(0, max_level))
+    W = W.isel(level=slice(0, max_level))
+    speed = np.sqrt(proj ** 2 + W ** 2)
+    speed_max = np.ceil(np.amax(np.abs(speed.values)) * 4) / 4
+
+    # Draw arrows every 50 km horizontal, 1 km height
+    arrow_step_v = 1000
+    arrow_step_h = 50000
+    heights = np.arange(proj.level[0] + arrow_step_v / 2, proj.level[-1], arrow_step_v)
+    distances = np.arange(proj.transect_axis[0] + arrow_step_h / 2, proj.transect_axis[-1], arrow_step_h)
+    proj_quiver = proj.interp(transect_axis=distances).interp(level=heights)
+    W_quiver = W.interp(transect_axis=distances).interp(level=heights)
+
+    return {
+        'figsize' : (8, 8), 'distance' : proj.transect_axis.values, 'level' : proj.level.values,
+        'shading' : speed.values, 'levels' : np.arange(0, speed_max + 0.25, 0.25), 'cmap' : 'Reds',
+        'label' : 'Perturbation Velocity [m/s]', 'title' : 'Perturbation Velocity [m/s]',
+        'lst' : lst,
+        'quiver' : {
+            'distance' : distances, 'level' : heights,
+            'u' : proj_quiver.values, 'v' : W_quiver.values,
+            'scale' : speed_max / np.sqrt(arrow_step_v ** 2 + arrow_step_h ** 2),
+        },
+    }
+
+def theta_spec(T, clouds, lst):
+    """
+    Describe the potential temperature cross section: anomaly shading with liquid water contours.
+    """
+
+    T = T.isel(level=slice(0, max_level))
+    liquid = (clouds.QRAIN + clouds.QCLOUD).isel(level=slice(0, max_level))
+    T_max = np.ceil(np.amax(np.abs(T.values)) * 4) / 4
+    c_levels = [3 * 10 ** -5, 4 * 10 ** -5]
+
+    return {
+        'figsize' : (6, 6), 'distance' : T.transect_axis.values, 'level' : T.level.values,
+        'shading' : T.values, 'levels' : np.arange(-T_max, T_max + 0.25, 0.25), 'cmap' : 'RdBu_r',
+        'label' : 'Potential Temperature Anomaly [K]',
+        'title' : 'WRF Potential Temperature Anomaly [K] \n WRF Liquid Water Ratio [kg/kg]',
+        'lst' : lst,
+        'contour' : liquid.values, 'contour_levels' : c_levels,
+        'contour_labels' : [r'$' + str(int(i)) + r'$ $\cdot$ $10^{-5}$' for i in np.array(c_levels) * 10 ** 5],
+        'contour_label' : 'Liquid Water Ratio [kg/kg]',
+    }
+
+def render(spec, directory, workers=1, dpi=80):
+    """
+    Render every frame to directory in local solar time order, returning the frame paths.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    order = np.argsort(spec['lst'])
+    paths = [os.path.join(directory, 'frame_{:03d}.png'.format(n)) for n in range(order.size)]
+
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=workers, initializer=_init_worker, initargs=(spec,)
+    ) as pool:
+        return list(pool.map(_render, order, paths, [dpi] * order.size))
+
+def assemble(paths, save_path, fps=5):
+    """
+    Join frames into a GIF or, through ffmpeg, a video chosen by the extension of save_path.
+    """
+
+    with imageio.get_writer(save_path, fps=fps) as writer:
+        for path in paths:
+            writer.append_data(imageio.imread(path))
+
+    return save_path
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Animate diurnal WRF cross sections.')
+    parser.add_argument('--kinds', nargs='+', default=['velocity', 'theta'], choices=['velocity', 'theta'])
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--format', default='gif', choices=['gif', 'mp4'])
+    parser.add_argument('--fps', type=int, default=5)
+    args = parser.parse_args()
+
+    # Define local solar time based on mean of transect lon values
+    geometry = rt.get_geometry('WRF')
+    lon_mean = np.mean(np.concatenate((geometry.trans_lon0, geometry.trans_lon1)))
+
+    dt = datetime.datetime.now().strftime('%Y%m%d_%H_%M_%S')
+
+    for kind in args.kinds:
+        print('Animating {} cross section.'.format(kind))
+
+        if kind == 'velocity':
+            proj = xr.open_dataset(means_dir + '/wind_proj_goulburn_12.nc').wind_proj
+            W = xr.open_dataset(means_dir + '/W_goulburn_12.nc').W
+            spec = velocity_spec(proj, W, local_solar_time(proj.hour.values, lon_mean))
+            directory = '/g/data/w40/esh563/goulburn_NT/cross_sect_' + dt
+        else:
+            T = xr.open_dataset(means_dir + '/T_goulburn_12.nc').T
+            clouds = xr.open_dataset(means_dir + '/clouds_goulburn_12.nc')
+            spec = theta_spec(T, clouds, local_solar_time(T.hour.values, lon_mean))
+            directory = '/g/data/w40/esh563/goulburn_NT/theta_cross_sect_' + dt
+
+        paths = render(spec, directory, workers=args.workers)
+        assemble(paths, directory + '/{}.{}'.format(kind, args.format), fps=args.fps)
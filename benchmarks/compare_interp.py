@@ -0,0 +1,46 @@
+# Core
+import os
+import sys
+import time
+import tracemalloc
+
+# Analysis
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import transect_analysis as ta
+from legacy import horizontal_tran_interp_outer
+from synthetic import synthetic_dataset, COAST
+
+def measure(func, *args, **kwargs):
+    """
+    Return result, wall time and peak traced memory of a call.
+    """
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return result, elapsed, peak
+
+if __name__ == '__main__':
+
+    trans_lon0, trans_lat0, trans_lon1, trans_lat1, n_points, n_trans, coast_distances, tran_distances = ta.define_transects(
+        *COAST, 453300, spacing = 4000
+    )
+
+    cube = synthetic_dataset(n_time=24, n_levels=71).U
+    args = (cube, trans_lon0[0], trans_lat0[0], trans_lon1[0], trans_lat1[0])
+
+    old, old_time, old_peak = measure(horizontal_tran_interp_outer, *args, n=n_points)
+    new, new_time, new_peak = measure(ta.horizontal_tran_interp, *args, n=n_points)
+
+    # float32 values near zero differ by rounding alone, so allow a small absolute error
+    np.testing.assert_allclose(new.values, old.values, rtol=1e-6, atol=1e-6, equal_nan=True)
+
+    print('n_points = {}'.format(n_points))
+    print('outer grid : {:.3f} s, {:.1f} MB peak'.format(old_time, old_peak / 2 ** 20))
+    print('pointwise  : {:.3f} s, {:.1f} MB peak'.format(new_time, new_peak / 2 ** 20))
@@ -0,0 +1,31 @@
+# Core
+import os
+import sys
+import tracemalloc
+
+# Testing
+import pytest
+
+# Make transect_analysis and the benchmark helpers importable
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, here)
+sys.path.insert(0, os.path.join(here, '..'))
+
+@pytest.fixture
+def run_benchmark(benchmark):
+    """
+    Benchmark a call, recording its peak traced memory in the benchmark report.
+    """
+
+    def run(func, *args, **kwargs):
+        # Time first so a failing call is reported against the benchmark
+        result = benchmark(func, *args, **kwargs)
+
+        tracemalloc.start()
+        func(*args, **kwargs)
+        benchmark.extra_info['peak_memory_mb'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+        return result
+
+    return run
@@ -0,0 +1,77 @@
+# Analysis
+import xarray as xr
+import numpy as np
+
+def horizontal_tran_interp_outer(ds, lon0, lat0, lon1, lat1, n):
+    """
+    Previous implementation: interpolate onto the full n by n grid then keep the diagonal.
+    """
+
+    lon = np.linspace(lon0, lon1, num=n)
+    lat = np.linspace(lat0, lat1, num=n)
+
+    ds_interp = ds.interp(longitude=lon, latitude=lat)
+
+    ds_interp = ds_interp.isel(
+        longitude=xr.DataArray(
+            np.arange(0,np.size(lon)),
+            dims='transect_axis'),
+        latitude=xr.DataArray(
+            np.arange(0,np.size(lon)),
+            dims='transect_axis',)
+    )
+    ds_interp = ds_interp.drop('longitude').drop('latitude')
+
+    return ds_interp
+
+def calc_transects_loop(ds, trans_lon0, trans_lat0, trans_lon1, trans_lat1, n_points, n_trans):
+    """
+    Previous implementation: interpolate each transect separately and concatenate.
+    """
+
+    tran_list = [
+        horizontal_tran_interp_outer(ds, trans_lon0[i], trans_lat0[i], trans_lon1[i], trans_lat1[i], n=n_points)
+        for i in range(n_trans)
+    ]
+
+    return xr.concat(tran_list, dim = 'coastal_axis')
+
+def running_anomaly_rolling(ds):
+    """
+    Previous implementation of the 24 h perturbation.
+    """
+
+    return (ds - ds.rolling(time=24, center=True).mean()).dropna('time')
+
+def diurnal_composite_concat(tran_list):
+    """
+    Previous implementation of calc_tran_mean: concatenate every year then group by hour.
+    """
+
+    tran = xr.concat(tuple(tran_list), dim = 'time')
+
+    return tran.groupby('time.hour').mean('time')
+
+def regrid_vertical_loop(values, coords, levels):
+    """
+    Reference implementation: np.interp over each column in turn.
+    """
+
+    n_level = values.shape[-1]
+    flat_values = values.reshape(-1, n_level)
+    flat_coords = coords.reshape(-1, n_level)
+
+    result = np.array([
+        np.interp(levels, z, v, left=np.nan, right=np.nan) for z, v in zip(flat_coords, flat_values)
+    ])
+
+    return result.reshape(values.shape[:-1] + (len(levels),))
+
+def lst_composite_groupby(da, lon_mean):
+    """
+    Previous notebook approach: hourly UTC composite shifted by the mean longitude.
+    """
+
+    time = da.time + (np.timedelta64(int(round(lon_mean / 15 * 3600)), 's'))
+
+    return da.assign_coords(time=time).groupby('time.hour').mean('time')
@@ -0,0 +1,49 @@
+# Analysis
+import xarray as xr
+import numpy as np
+import pandas as pd
+
+# Goulburn domain used for the cropped WRF files
+lat_range = (-12.5, -8)
+lon_range = (133, 136)
+
+# Grid spacings in degrees: WRF 4 km, CMORPH 8 km, TRMM 3B42 0.25 degrees
+GRIDS = {'WRF' : 0.04, 'CMORPH' : 0.0727, 'TRMM_3B42' : 0.25}
+
+# Transect spacings in metres used by the product scripts
+SPACINGS = [4000, 8000, 12500, 25000]
+
+# Coastline segment used by every product script
+COAST = (134.5293, -12.4715, 133.3290, -12.1468)
+
+def synthetic_dataset(grid_spacing=0.04, n_levels=71, n_time=24, start='2005-12-01', nan_fraction=0, seed=0):
+    """
+    Create a WRF-like dataset on a regular latitude longitude grid.
+
+    The field is a smooth diurnal sea breeze like signal plus noise, so
+    interpolated values and composites are non-trivial. Set n_levels to 0
+    for a surface field.
+    """
+
+    rng = np.random.default_rng(seed)
+
+    latitude = np.arange(lat_range[0], lat_range[1] + grid_spacing / 2, grid_spacing)
+    longitude = np.arange(lon_range[0], lon_range[1] + grid_spacing / 2, grid_spacing)
+    time = pd.date_range(start, periods=n_time, freq='h')
+
+    dims = ['time', 'latitude', 'longitude']
+    coords = {'time' : time, 'latitude' : latitude, 'longitude' : longitude}
+    shape = (n_time, latitude.size, longitude.size)
+    if n_levels > 0:
+        dims.insert(1, 'level')
+        coords['level'] = np.linspace(20, 20000, n_levels)
+        shape = (n_time, n_levels, latitude.size, longitude.size)
+
+    hour = time.hour.values.reshape((-1,) + (1,) * (len(shape) - 1))
+    signal = np.sin(2 * np.pi * hour / 24) * np.cos(np.deg2rad(longitude - 134) * 10)
+    data = (signal + 0.1 * rng.standard_normal(shape)).astype(np.float32)
+
+    if nan_fraction > 0:
+        data[rng.random(shape) < nan_fraction] = np.nan
+
+    return xr.Dataset({'U' : (dims, data)}, coords=coords)
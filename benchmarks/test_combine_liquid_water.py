@@ -0,0 +1,67 @@
+"""
+Tests of the monthly cloud conversion in WRF_scripts/combine_liquid_water.py.
+
+Run with
+
+    python -m pytest benchmarks/test_combine_liquid_water.py
+"""
+
+# Core
+import os
+import sys
+
+# Testing
+import pytest
+
+for module in ['xarray', 'dask', 'zarr', 'netCDF4']:
+    pytest.importorskip(module)
+
+# Analysis
+import xarray as xr
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'WRF_scripts'))
+import combine_liquid_water as clw
+import storage
+
+COORDS = {'level' : np.arange(4.0), 'latitude' : np.arange(5.0), 'longitude' : np.arange(6.0)}
+
+@pytest.fixture
+def hourly(tmp_path, monkeypatch):
+    """
+    Two days of 12 hourly cropped cloud files with the raw WRF dimension names.
+    """
+
+    monkeypatch.setattr(clw, 'base_dir', str(tmp_path))
+    directory = tmp_path / '20052006' / 'clouds'
+    directory.mkdir(parents=True)
+
+    rng = np.random.default_rng(0)
+    files = []
+    for day in [1, 2]:
+        for hour in [0, 12]:
+            ds = xr.Dataset({
+                'QCLOUD' : (('Time', 'bottom_top', 'south_north', 'west_east'), rng.random((12, 4, 5, 6), dtype=np.float32))
+            })
+            ds.to_netcdf(directory / 'clouds_goulburn_200512{:02d}{:02d}.nc'.format(day, hour))
+            files.append(ds)
+
+    return xr.concat(files, dim='Time').QCLOUD.values
+
+@pytest.mark.parametrize('store', ['zarr', 'compressed'])
+def test_convert_monthly(hourly, store, capsys):
+    clw.convert_monthly(2005, COORDS, store=store)
+
+    path = storage.find_intermediate(clw.monthly_path(2005, 'netcdf'))
+    assert path == clw.monthly_path(2005, store)
+
+    # Read as run_transects.py reads the monthly store
+    cloud = storage.open_intermediate(path, chunks={'time' : 24})
+    assert cloud.QCLOUD.dims == ('time', 'level', 'latitude', 'longitude')
+    assert cloud.QCLOUD.chunks[0][0] == 24
+    np.testing.assert_array_equal(cloud.QCLOUD.values, hourly)
+    cloud.close()
+
+    # Unchanged hourly files are not converted again
+    clw.convert_monthly(2005, COORDS, store=store)
+    assert 'Up to date 2005.' in capsys.readouterr().out
@@ -0,0 +1,169 @@
+"""
+Tests of the TRMM 3B42 downloader against a local server.
+
+Run with
+
+    python -m pytest benchmarks/test_download.py
+"""
+
+# Core
+import asyncio
+import datetime
+import hashlib
+import os
+import re
+import sys
+
+# Testing
+import pytest
+
+web = pytest.importorskip('aiohttp.web')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'TRMM_scripts'))
+import download_TRMM_3B42 as dl
+
+URLS = [
+    'https://disc2.gesdisc.eosdis.nasa.gov/opendap/TRMM_L3/TRMM_3B42.7/README.pdf',
+    'https://disc2.gesdisc.eosdis.nasa.gov/opendap/TRMM_L3/TRMM_3B42.7/2005/335/3B42.20051201.00.7.HDF.nc4?precipitation',
+    'https://disc2.gesdisc.eosdis.nasa.gov/opendap/TRMM_L3/TRMM_3B42.7/2006/001/3B42.20060101.03.7.HDF.nc4?precipitation',
+]
+
+CONTENT = bytes(range(256)) * 400
+
+class Server:
+    """
+    Serve CONTENT at every path, honouring Range unless told to ignore it.
+
+    The first failures requests get a 503. Every request is recorded as (path, Range header).
+    """
+
+    def __init__(self, ignore_range=False, failures=0):
+        self.ignore_range = ignore_range
+        self.failures = failures
+        self.requests = []
+
+    async def handle(self, request):
+        self.requests.append((request.path, request.headers.get('Range')))
+        if self.failures > 0:
+            self.failures -= 1
+            return web.Response(status=503)
+
+        match = re.match(r'bytes=(\d+)-$', request.headers.get('Range', ''))
+        if match is None or self.ignore_range:
+            return web.Response(body=CONTENT)
+
+        start = int(match.group(1))
+        if start >= len(CONTENT):
+            return web.Response(status=416, headers={'Content-Range' : 'bytes */{}'.format(len(CONTENT))})
+
+        return web.Response(status=206, body=CONTENT[start:], headers={
+            'Content-Range' : 'bytes {}-{}/{}'.format(start, len(CONTENT) - 1, len(CONTENT))
+        })
+
+def run_download(server, entries, directory):
+    """
+    Download entries from a local server on a free port, returning the failed URLs.
+    """
+
+    async def main():
+        app = web.Application()
+        app.router.add_route('GET', '/{tail:.*}', server.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        host, port = runner.addresses[0][:2]
+        try:
+            return await dl.download(
+                entries, directory, retries=3, backoff=0.01, prefix='http://{}:{}'.format(host, port)
+            )
+        finally:
+            await runner.cleanup()
+
+    return asyncio.run(main())
+
+@pytest.fixture
+def entries(tmp_path, monkeypatch):
+    # Keep requests to the local server away from any configured proxy
+    for name in ['http_proxy', 'HTTP_PROXY', 'all_proxy', 'ALL_PROXY']:
+        monkeypatch.delenv(name, raising=False)
+
+    url_list = tmp_path / 'urls.txt'
+    url_list.write_text('\n'.join(URLS) + '\n')
+
+    return dl.select(dl.read_url_list(str(url_list)), years=[2005])
+
+def target(directory, entries):
+    url, name, time = entries[0]
+
+    return dl.target_path(str(directory), name, time)
+
+def check_file(directory, path):
+    with open(path, 'rb') as f:
+        assert f.read() == CONTENT
+    assert not os.path.exists(path + '.part')
+
+    record = dl.load_checksums(str(directory))[os.path.relpath(path, str(directory))]
+    assert record == {'size' : len(CONTENT), 'sha256' : hashlib.sha256(CONTENT).hexdigest()}
+
+def write_part(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.part', 'wb') as f:
+        f.write(data)
+
+def test_read_url_list_and_select(entries):
+    assert entries == [(URLS[1], '3B42.20051201.00.7.HDF.nc4', datetime.datetime(2005, 12, 1, 0))]
+
+def test_resume_with_range(tmp_path, entries):
+    server = Server()
+    path = target(tmp_path, entries)
+    write_part(path, CONTENT[:1000])
+
+    assert run_download(server, entries, str(tmp_path)) == []
+
+    assert [r[1] for r in server.requests] == ['bytes=1000-']
+    check_file(tmp_path, path)
+
+def test_restart_when_range_ignored(tmp_path, entries):
+    server = Server(ignore_range=True)
+    path = target(tmp_path, entries)
+    write_part(path, CONTENT[:1000])
+
+    assert run_download(server, entries, str(tmp_path)) == []
+
+    assert [r[1] for r in server.requests] == ['bytes=1000-']
+    check_file(tmp_path, path)
+
+def test_complete_part_not_satisfiable(tmp_path, entries):
+    server = Server()
+    path = target(tmp_path, entries)
+    write_part(path, CONTENT)
+
+    assert run_download(server, entries, str(tmp_path)) == []
+
+    assert [r[1] for r in server.requests] == ['bytes={}-'.format(len(CONTENT))]
+    check_file(tmp_path, path)
+
+def test_retry_after_unavailable(tmp_path, entries):
+    server = Server(failures=2)
+
+    assert run_download(server, entries, str(tmp_path)) == []
+
+    assert len(server.requests) == 3
+    check_file(tmp_path, target(tmp_path, entries))
+
+def test_skip_matching_checksum(tmp_path, entries):
+    run_download(Server(), entries, str(tmp_path))
+
+    server = Server()
+    assert run_download(server, entries, str(tmp_path)) == []
+    assert server.requests == []
+
+    # A file changed since its checksum was recorded is fetched again
+    path = target(tmp_path, entries)
+    with open(path, 'r+b') as f:
+        f.write(bytes([CONTENT[0] ^ 0xff]))
+
+    assert run_download(server, entries, str(tmp_path)) == []
+    assert len(server.requests) == 1
+    check_file(tmp_path, path)
@@ -0,0 +1,37 @@
+"""
+Tests of the run_transects unit registry.
+
+Run with
+
+    python -m pytest benchmarks/test_run_transects.py
+"""
+
+# Testing
+import pytest
+
+# The pipeline modules need the full analysis environment
+for module in ['xarray', 'dask', 'scipy', 'pyproj']:
+    pytest.importorskip(module)
+
+import run_transects as rt
+
+def test_make_units_optional_variable():
+    units = rt.make_units(['WRF'], ['Z'], years=[2005, 2006])
+
+    assert units == [('WRF', ('Z',), 2005, 12), ('WRF', ('Z',), 2006, 12)]
+
+def test_make_units_default_skips_optional():
+    units = rt.make_units(['WRF'], years=[2005])
+
+    assert [unit[1] for unit in units] == [(v,) for v in rt.PRODUCTS['WRF']['variables']]
+
+def test_make_units_fused_optional():
+    units = rt.make_units(['WRF'], ['wind_proj', 'Z'], years=[2005], fused=True)
+
+    assert units == [('WRF', ('wind_proj', 'Z'), 2005, 12)]
+
+def test_Z_output_read_by_regrid_transects():
+    unit = rt.make_units(['WRF'], ['Z'], years=[2005])[0]
+    output = rt.unit_outputs(unit)[0][0]
+
+    assert output == rt.save_path('WRF', 'Z', 2005, 12)
@@ -0,0 +1,99 @@
+"""
+Tests of the resampling p-values in significance.py.
+
+Run with
+
+    python -m pytest benchmarks/test_significance.py
+"""
+
+# Testing
+import pytest
+
+pytest.importorskip('xarray')
+
+# Analysis
+import xarray as xr
+import numpy as np
+import pandas as pd
+
+import significance
+
+def perturbations(n_days=60, n_points=40, mean=0, nan_fraction=0, seed=0):
+    """
+    Hourly (time, point) perturbations, independent between days.
+    """
+
+    rng = np.random.default_rng(seed)
+    time = pd.date_range('2005-12-01', periods=24 * n_days, freq='h')
+    values = mean + rng.standard_normal((time.size, n_points))
+    values[rng.random(values.shape) < nan_fraction] = np.nan
+
+    return xr.DataArray(values, dims=('time', 'point'), coords={'time' : time, 'point' : np.arange(n_points)})
+
+def exceedances_loop(samples, streams, sizes, method):
+    """
+    Reference for significance._exceedances, one resample and one point at a time in float64.
+    """
+
+    n_day = samples.shape[0]
+    samples = samples.reshape(n_day, -1)
+    exceed = np.zeros(samples.shape[1], dtype=np.int64)
+
+    # Draw the same weights as _exceedances, one batch per stream
+    weights = []
+    for stream, size in zip(streams, sizes):
+        rng = np.random.default_rng(stream)
+        if method == 'permutation':
+            weights.append(rng.choice(np.array([-1, 1], dtype=np.float32), size=(size, n_day)))
+        else:
+            weights.append(rng.multinomial(n_day, np.full(n_day, 1 / n_day), size=size))
+    weights = np.concatenate(weights)
+
+    for j in range(samples.shape[1]):
+        valid = ~np.isnan(samples[:, j])
+        x = samples[valid, j]
+        observed = abs(x.mean())
+        if method == 'bootstrap':
+            x = x - x.mean()
+        for w in weights:
+            w = w[valid]
+            n = valid.sum() if method == 'permutation' else w.sum()
+            if abs((w * x).sum() / n) >= observed * (1 - 1e-5):
+                exceed[j] += 1
+
+    return exceed
+
+@pytest.mark.parametrize('method', ['permutation', 'bootstrap'])
+def test_uniform_under_null(method):
+    p = significance.p_values(perturbations(), n_resamples=199, method=method).values.ravel()
+
+    # 960 independent p-values, so these bounds are several standard errors wide
+    assert 0.45 < p.mean() < 0.55
+    assert 0.025 < (p < 0.05).mean() < 0.08
+    np.testing.assert_allclose(np.histogram(p, bins=5, range=(0, 1))[0] / p.size, 0.2, atol=0.05)
+
+def test_signal_detected():
+    p = significance.p_values(perturbations(mean=1), n_resamples=99)
+
+    np.testing.assert_allclose(p.values, 1 / 100)
+
+@pytest.mark.parametrize('method', ['permutation', 'bootstrap'])
+def test_workers_reproducible(method):
+    da = perturbations(n_days=20, n_points=5, nan_fraction=0.05)
+    kwargs = {'n_resamples' : 500, 'method' : method, 'seed' : 3, 'batch_size' : 64}
+
+    serial = significance.p_values(da, workers=1, **kwargs)
+
+    xr.testing.assert_identical(serial, significance.p_values(da, workers=3, **kwargs))
+    assert not serial.identical(significance.p_values(da, workers=1, **dict(kwargs, seed=4)))
+
+@pytest.mark.parametrize('method', ['permutation', 'bootstrap'])
+def test_exceedances_match_loop(method):
+    samples, template = significance.hourly_samples(perturbations(n_days=15, n_points=3, nan_fraction=0.1))
+    streams = np.random.SeedSequence(0).spawn(3)
+    sizes = [32, 32, 7]
+
+    significance._init_worker(samples)
+    exceed = significance._exceedances(streams, sizes, method)
+
+    np.testing.assert_array_equal(exceed, exceedances_loop(samples, streams, sizes, method))
@@ -0,0 +1,187 @@
+"""
+Benchmarks of the transect_analysis hot paths on synthetic data.
+
+Run with
+
+    pip install -r benchmarks/requirements.txt
+    python -m pytest benchmarks --benchmark-only
+
+Each benchmark also checks the result against the previous implementation.
+"""
+
+# Testing
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+# Analysis
+import xarray as xr
+import numpy as np
+
+import transect_analysis as ta
+import legacy
+from synthetic import synthetic_dataset, GRIDS, SPACINGS, COAST
+
+# Synthetic fields are float32 of order one, so values near zero differ
+# between implementations by rounding alone
+FLOAT32_ATOL = 1e-6
+
+def transects(spacing):
+    """
+    Transect endpoints and sizes for the standard coastline at a given spacing.
+    """
+
+    return ta.define_transects(*COAST, 453300, spacing = spacing)
+
+@pytest.mark.parametrize('spacing', SPACINGS)
+def test_define_transects(run_benchmark, spacing):
+    run_benchmark(ta.define_transects, *COAST, 453300, spacing = spacing)
+
+@pytest.mark.parametrize('n_levels', [0, 71])
+def test_horizontal_tran_interp(run_benchmark, n_levels):
+    ds = synthetic_dataset(GRIDS['WRF'], n_levels=n_levels, n_time=24)
+    trans_lon0, trans_lat0, trans_lon1, trans_lat1, n_points = transects(4000)[0:5]
+    args = (ds, trans_lon0[0], trans_lat0[0], trans_lon1[0], trans_lat1[0])
+
+    tran = run_benchmark(ta.horizontal_tran_interp, *args, n=n_points)
+
+    xr.testing.assert_allclose(tran, legacy.horizontal_tran_interp_outer(*args, n=n_points), atol=FLOAT32_ATOL)
+
+@pytest.mark.parametrize('grid', list(GRIDS))
+@pytest.mark.parametrize('spacing', SPACINGS)
+def test_calc_transects(run_benchmark, grid, spacing):
+    ds = synthetic_dataset(GRIDS[grid], n_levels=10, n_time=24, nan_fraction=0.01)
+    args = transects(spacing)[0:6]
+
+    # Fresh operators each round, so weight construction is included
+    ta._operators.clear()
+    tran = run_benchmark(lambda: (ta._operators.clear(), ta.calc_transects(ds, *args))[1])
+
+    xr.testing.assert_allclose(
+        tran, legacy.calc_transects_loop(ds, *args).transpose(*tran.U.dims), atol=FLOAT32_ATOL
+    )
+
+@pytest.mark.parametrize('spacing', [4000, 25000])
+def test_calc_transects_cached(run_benchmark, spacing):
+    ds = synthetic_dataset(GRIDS['WRF'], n_levels=71, n_time=24)
+    args = transects(spacing)[0:6]
+    ta.calc_transects(ds, *args)
+
+    run_benchmark(ta.calc_transects, ds, *args)
+
+@pytest.mark.parametrize('spacing', [8000, 25000])
+def test_coastal_mean_skipna(run_benchmark, spacing):
+    ds = synthetic_dataset(GRIDS['CMORPH'], n_levels=0, n_time=24 * 7, nan_fraction=0.05)
+    geometry = ta.TransectGeometry.from_params(*COAST, 453300, spacing)
+
+    tran = run_benchmark(geometry.calc_transects, ds, mode='coastal_mean', skipna=True)
+
+    # Missing grid values are left out of the interpolation weights and the along coast mean
+    total = geometry.calc_transects(ds.fillna(0)).mean('coastal_axis')
+    weight = geometry.calc_transects(ds.notnull().astype(float)).mean('coastal_axis')
+    expected = (total / weight.where(weight > 0)).transpose(*tran.U.dims)
+    xr.testing.assert_allclose(tran, expected, atol=1e-6)
+
+    # Without skipna one missing neighbour makes the whole mean missing
+    fused = geometry.calc_transects(ds, mode='coastal_mean')
+    assert int(fused.U.isnull().sum()) > int(tran.U.isnull().sum())
+
+@pytest.mark.parametrize('chunked', [False, True])
+@pytest.mark.parametrize('mode', ['full', 'coastal_mean'])
+def test_calc_transect_families(run_benchmark, mode, chunked):
+    ds = synthetic_dataset(GRIDS['CMORPH'], n_levels=5, n_time=48)
+    if chunked:
+        ds = ds.chunk({'time' : 24})
+    geometries = {
+        'goulburn' : ta.TransectGeometry.from_params(*COAST, 453300, 8000),
+        'offshore' : ta.TransectGeometry.from_params(134.0, -11.5, 133.0, -11.2, 200000, 25000),
+    }
+
+    def calc(families):
+        trans = ta.calc_transect_families(ds, {f : geometries[f] for f in families}, mode=mode)
+        return {family : tran.compute() for family, tran in trans.items()}
+
+    # One family, as every product script runs by default, and two sharing a read
+    single = run_benchmark(calc, ['goulburn'])
+    both = calc(list(geometries))
+
+    for trans in [single, both]:
+        for family, tran in trans.items():
+            xr.testing.assert_allclose(tran, geometries[family].calc_transects(ds, mode=mode).compute())
+
+@pytest.mark.parametrize('n_time', [24 * 7, 24 * 31])
+def test_running_anomaly(run_benchmark, n_time):
+    ds = synthetic_dataset(GRIDS['TRMM_3B42'], n_levels=10, n_time=n_time)
+
+    anomaly = run_benchmark(lambda: ta.running_anomaly(ds).dropna('time'))
+
+    xr.testing.assert_allclose(anomaly, legacy.running_anomaly_rolling(ds), atol=1e-5)
+
+@pytest.mark.parametrize('n_years', [3, 10])
+def test_diurnal_composite(run_benchmark, n_years):
+    years = [
+        synthetic_dataset(GRIDS['TRMM_3B42'], n_levels=10, n_time=24 * 31, start='{}-12-01'.format(2005 + i), seed=i)
+        for i in range(n_years)
+    ]
+
+    def accumulate():
+        acc = ta.DiurnalAccumulator()
+        for ds in years:
+            acc.update(ds)
+        return acc.composite()
+
+    composite = run_benchmark(accumulate)
+
+    xr.testing.assert_allclose(composite, legacy.diurnal_composite_concat(years), atol=1e-5)
+
+@pytest.mark.parametrize('n_time', [24, 24 * 7])
+def test_regrid_vertical(run_benchmark, n_time):
+    ds = synthetic_dataset(GRIDS['WRF'], n_levels=71, n_time=n_time).isel(latitude=slice(0, 20), longitude=slice(0, 20))
+    rng = np.random.default_rng(0)
+
+    # Terrain following heights that vary from column to column, built from
+    # positive layer thicknesses so every column increases with height
+    thickness = np.diff(ds.level.values, prepend=0).reshape(1, -1, 1, 1)
+    z = xr.DataArray(
+        np.cumsum(thickness * (1 + 0.05 * rng.random(ds.U.shape)), axis=1), 
+        dims=ds.U.dims, coords=ds.U.coords
+    )
+    heights = np.arange(100, 15001, 100)
+
+    regridded = run_benchmark(ta.regrid_vertical, ds.U, z, heights)
+
+    expected = legacy.regrid_vertical_loop(
+        ds.U.transpose(..., 'level').values, z.transpose(..., 'level').values, heights
+    )
+    np.testing.assert_allclose(regridded.transpose(..., 'height').values, expected, rtol=1e-5, atol=FLOAT32_ATOL, equal_nan=True)
+
+@pytest.mark.parametrize('n_time', [24 * 31, 24 * 31 * 10])
+def test_lst_composite(run_benchmark, n_time):
+    ds = synthetic_dataset(GRIDS['TRMM_3B42'], n_levels=10, n_time=n_time)
+
+    # A single longitude everywhere reduces to shifting UTC by a whole number of hours
+    longitude = xr.full_like(ds.U.isel(time=0, level=0, drop=True), 135.0)
+
+    composite = run_benchmark(ta.lst_composite, ds.U, longitude)
+
+    expected = legacy.lst_composite_groupby(ds.U, 135.0).rename(hour='lst')
+    np.testing.assert_allclose(
+        composite.transpose(*expected.dims).values, expected.values, rtol=1e-5, atol=FLOAT32_ATOL
+    )
+
+@pytest.mark.parametrize('hours', [np.arange(24), np.array([0, 6, 10, 12, 18, 22])])
+def test_diurnal_harmonics(run_benchmark, hours):
+    rng = np.random.default_rng(0)
+    shape = (hours.size, 71, 113)
+    amplitude = rng.uniform(0.5, 2, shape[1:])
+    peak = rng.uniform(0, 24, shape[1:])
+    values = 1 + amplitude * np.cos(2 * np.pi * (hours[:, None, None] - peak) / 24)
+    composite = xr.DataArray(values, dims=('hour', 'level', 'transect_axis'), coords={'hour' : hours})
+
+    # Irregular samples can resolve the mean and first harmonic only
+    n_harmonics = 3 if hours.size == 24 else 1
+    harmonics = run_benchmark(ta.diurnal_harmonics, composite, n_harmonics=n_harmonics)
+
+    np.testing.assert_allclose(harmonics['mean'].values, 1, atol=1e-8)
+    np.testing.assert_allclose(harmonics.amplitude.sel(harmonic=1).values, amplitude, rtol=1e-8)
+    xr.testing.assert_allclose(ta.reconstruct_harmonics(harmonics, hours), composite)
@@ -0,0 +1,23 @@
+# Core
+import sys
+
+# Analysis
+import xarray as xr
+import transect_analysis as ta
+
+# Composite file in transect_means, e.g. wind_proj_goulburn_2005-2014_12.nc
+file_name = str(sys.argv[1])
+
+# Optional number of harmonics and dimension of the diurnal cycle (hour, or lst for LST composites)
+n_harmonics = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+dim = str(sys.argv[3]) if len(sys.argv) > 3 else 'hour'
+
+base_dir = '/g/data/w40/esh563/goulburn_NT'
+
+print('Fitting {} harmonics to {}'.format(n_harmonics, file_name))
+
+composite = xr.open_dataset(base_dir + '/transect_means/' + file_name)
+harmonics = ta.diurnal_harmonics(composite, n_harmonics=n_harmonics, dim=dim)
+
+save_path = base_dir + '/transect_means/' + file_name.replace('.nc', '_harmonics.nc')
+harmonics.to_netcdf(path=save_path, mode='w', format='NETCDF4')
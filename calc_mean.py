@@ -1,22 +1,67 @@
-# Core 
+# Core
 import sys
 
-# Analysis 
+# Analysis
 import xarray as xr
 import numpy as np
+import dask
+import transect_analysis as ta
 
-folder = str(sys.argv[1])
-var = str(sys.argv[2])
+def calc_statistic(ds, statistic):
+    """
+    Lazily reduce a dataset along time. The mean keeps the variable names, other statistics are suffixed.
+    """
 
-print('Averaging ' + var)
+    if statistic == 'mean':
+        return ds.mean('time')
+    if statistic == 'var':
+        stat = ds.var('time')
+    elif statistic == 'max':
+        stat = ds.max('time')
+    elif statistic == 'min':
+        stat = ds.min('time')
+    elif statistic == 'diurnal':
+        stat = ds.groupby('time.hour').mean('time')
+    elif statistic.startswith('exceed_'):
+        stat = (ds > float(statistic[len('exceed_'):])).sum('time')
+    else:
+        raise ValueError('Unknown statistic {}.'.format(statistic))
 
-ds_path = '/g/data/w40/esh563/goulburn_NT/20*/{}/{}_*.nc'.format(folder, var)
+    return stat.rename({name : '{}_{}'.format(name, statistic) for name in stat.data_vars})
 
-ds_mean = xr.open_mfdataset(ds_path, chunks = {'time' : 744}).mean('time')
+if __name__ == '__main__':
 
-if not(sys.argv[3] in ['False', 'false', 'f', '0']):
-    z = np.loadtxt('average_model_levels.txt')[0:71]
-    ds_mean = ds_mean.assign_coords(level = z)
+    folder = str(sys.argv[1])
+    var = str(sys.argv[2])
 
-save_path = '/g/data/w40/esh563/goulburn_NT/means/{}_goulburn_12.nc'.format(var)
-ds_mean.to_netcdf(path=save_path, mode='w', format='NETCDF4')
+    # Optional comma separated statistics, e.g. mean,var,max,diurnal,exceed_0.001
+    statistics = ['mean']
+    if len(sys.argv) > 4:
+        statistics = str(sys.argv[4]).split(',')
+
+    # Optional number of worker processes for a local dask cluster
+    workers = 1
+    if len(sys.argv) > 5:
+        workers = int(sys.argv[5])
+
+    print('Averaging ' + var)
+
+    if workers > 1:
+        from dask.distributed import Client, LocalCluster
+        client = Client(LocalCluster(n_workers=workers, threads_per_worker=1))
+
+    ds_path = '/g/data/w40/esh563/goulburn_NT/20*/{}/{}_*.nc'.format(folder, var)
+
+    ds = xr.open_mfdataset(ds_path, chunks = {'time' : ta.TIME_CHUNK})
+
+    # Compute every statistic together, so each chunk is read once and shared
+    # by all the (tree) reductions
+    stats = dask.compute(*[calc_statistic(ds, statistic) for statistic in statistics])
+    ds_mean = xr.merge(stats)
+
+    if not(sys.argv[3] in ['False', 'false', 'f', '0']):
+        z = np.loadtxt('average_model_levels.txt')[0:71]
+        ds_mean = ds_mean.assign_coords(level = z)
+
+    save_path = '/g/data/w40/esh563/goulburn_NT/means/{}_goulburn_12.nc'.format(var)
+    ds_mean.to_netcdf(path=save_path, mode='w', format='NETCDF4')
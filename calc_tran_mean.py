@@ -1,56 +1,222 @@
-# Core 
+# Core
+import argparse
 import glob
-import sys
+import json
+import os
 
-# Analysis 
+# Analysis
 import xarray as xr
 import numpy as np
+import transect_analysis as ta
+import storage
+import instrument
+import significance
+import run_transects as rt
+from manifest import fingerprint
 
-file_prepend = str(sys.argv[1])
+parser = argparse.ArgumentParser(description='Average a decade of transects into hour of day composites.')
+parser.add_argument('file_prepend', help='transect file prefix, e.g. wind_proj or CMORPH')
+parser.add_argument('running_mean', help='False to composite the fields rather than perturbations from the 24 h running mean')
+parser.add_argument('n_resamples', nargs='?', type=int, default=0, help='resamples for p-values of the composite, 0 for none')
+parser.add_argument('workers', nargs='?', type=int, default=os.cpu_count(), help='workers sharing the resamples')
+parser.add_argument('--lst', action='store_true', help='also composite in local solar time at each transect point')
+parser.add_argument('--lst-bin', type=float, default=1, help='width of the local solar time bins in hours')
+args = parser.parse_args()
+
+file_prepend = args.file_prepend
+running_mean = not(args.running_mean in ['False', 'false', 'f', '0'])
+n_resamples = args.n_resamples
+workers = args.workers
 
 print('Averaging ' + file_prepend)
 
+# Writes a timing report if GOULBURN_REPORT_DIR is set
+instrument.start_from_env('calc_tran_mean_' + file_prepend)
+
 years = [2005, 2006, 2007, 2008, 2009, 2010, 2011, 2012, 2013, 2014]
 month = '12'
 
-print('Calculating year {}.'.format(years[0]))
+base_dir = '/g/data/w40/esh563/goulburn_NT'
 
-tran_i = xr.open_dataset(
-    '/g/data/w40/esh563/goulburn_NT/transects/{}_goulburn_{}{}.nc'.format(file_prepend, str(years[0]), month)
-)
+def transect_path(year):
+    """
+    Return the transect file of a year and its layout, full or coastal_mean if only the along coast mean was saved.
+    """
 
-#date_times = np.arange(str(years[0]) + '-11', str(years[0]+1) + '-12', dtype='datetime64[h]')
+    path = storage.find_intermediate(
+        base_dir + '/transects/{}_goulburn_{}{}.nc'.format(file_prepend, str(year), month)
+    )
+    mean_path = storage.find_intermediate(
+        base_dir + '/transects/{}_goulburn_{}{}_coastal_mean.nc'.format(file_prepend, str(year), month)
+    )
+    if not os.path.exists(path) and os.path.exists(mean_path):
+        return mean_path, 'coastal_mean'
 
-if not(sys.argv[2] in ['False', 'false', 'f', '0']):
-    tran_i = (tran_i - tran_i.rolling(time=24, center=True).mean()).dropna('time')
-    print('Taking running mean.')
-    
-tran_i = tran_i.mean(dim='coastal_axis')
+    return path, 'full'
 
-tran_list = [tran_i] * len(years)
+def source_key(year, path, layout):
+    """
+    Identify the input of a year's state by year, layout and the manifest fingerprint of the file.
+    """
 
-for i in range(1,len(years)):
-    
-    print('Calculating year {}.'.format(years[i]))
+    return json.dumps(dict(fingerprint(path), year=year, layout=layout, path=path), sort_keys=True)
 
-    tran_i = xr.open_dataset(
-        '/g/data/w40/esh563/goulburn_NT/transects/{}_goulburn_{}{}.nc'.format(file_prepend, str(years[i]), month)
-    )
-    
-    #date_times = np.arange(str(years[i]) + '-11', str(years[i]+1) + '-12', dtype='datetime64[h]')
-    # tran_i = tran_i.assign_coords(time = date_times)
+def source_layout(acc):
+    """
+    Return the layout a saved state was accumulated from, or None if it is not recorded.
+    """
+
+    try:
+        return json.loads(acc.sources[0])['layout']
+    except (IndexError, KeyError, ValueError):
+        return None
+
+def open_year(path, mean=True):
+    """
+    Open a year of transects lazily as perturbations, if requested, averaged over coastal_axis unless mean is False.
+    """
+
+    tran = storage.open_intermediate(path, chunks={'time': ta.TIME_CHUNK})
+    if running_mean:
+        tran = ta.running_anomaly(tran, window=24).dropna('time')
+
+    return coastal_mean(tran) if mean else tran
+
+def transect_longitude(tran):
+    """
+    Longitude of each transect point, labelled like tran.
+
+    Files holding only the along coast mean have lost the individual points,
+    so the longitude averaged over coastal_axis is used for them instead.
+    """
+
+    product = file_prepend if file_prepend in rt.PRODUCTS else 'WRF'
+    longitude = rt.get_geometry(product).longitude
+    if 'coastal_axis' not in tran.dims:
+        longitude = longitude.mean('coastal_axis')
+
+    return longitude.assign_coords({dim : tran[dim].values for dim in longitude.dims})
+
+def coastal_mean(tran):
+    """
+    Average over coastal_axis unless the file already holds the along coast mean.
+    """
+
+    if 'coastal_axis' in tran.dims:
+        return tran.mean(dim='coastal_axis')
+
+    return tran
+
+def coastal_sum(da):
+    """
+    Sum over coastal_axis unless the file already holds the along coast mean.
+    """
+
+    if 'coastal_axis' in da.dims:
+        return da.sum(dim='coastal_axis')
 
-    if not(sys.argv[2] in ['False', 'false', 'f', '0']):
-        tran_i = (tran_i - tran_i.rolling(time=24, center=True).mean()).dropna('time')
+    return da
+
+# Each year's state is saved separately and keyed by the fingerprint of its
+# transect file. Years whose file is unchanged are not read again, and a
+# regenerated file replaces that year's contribution.
+state_dir = base_dir + '/transect_means/state'
+os.makedirs(state_dir, exist_ok=True)
+
+acc = ta.DiurnalAccumulator()
+
+for year in years:
+
+    path, layout = transect_path(year)
+    source = source_key(year, path, layout)
+    state_path = state_dir + '/{}_goulburn_{}{}{}.nc'.format(file_prepend, year, month, '_pert' if running_mean else '')
+
+    if os.path.exists(state_path):
+        year_acc = ta.DiurnalAccumulator.load(state_path)
+        previous = source_layout(year_acc)
+        if previous is not None and previous != layout:
+            raise ValueError(
+                'Year {} was accumulated from {} transects but {} is {}; remove {} to rebuild it.'.format(
+                    year, previous, path, layout, state_path
+                )
+            )
+        if year_acc.sources == [source]:
+            print('Year {} already included.'.format(year))
+            acc = acc.merge(year_acc)
+            continue
+        print('Transects of year {} changed.'.format(year))
+
+    print('Calculating year {}.'.format(year))
+
+    if running_mean:
         print('Taking running mean.')
-        
-    tran_i = tran_i.mean(dim='coastal_axis')
+    tran_i = open_year(path)
+
+    # Opening is lazy, so reading, the running mean and coastal mean are all computed here
+    with instrument.stage('accumulate', year=year):
+        year_acc = ta.DiurnalAccumulator.from_dataset(tran_i, source=source)
+
+    with instrument.stage('save_state', year=year):
+        year_acc.save(state_path)
+
+    acc = acc.merge(year_acc)
+
+tran_mean = acc.composite()
+tran_var = acc.variance()
+
+with instrument.stage('write'):
+    save_path = base_dir + '/transect_means/{}_goulburn_{}-{}_{}.nc'.format(file_prepend, years[0], years[-1], month)
+    tran_mean.to_netcdf(path=save_path, mode='w', format='NETCDF4')
+
+    save_path_var = base_dir + '/transect_means/{}_goulburn_{}-{}_{}_variance.nc'.format(file_prepend, years[0], years[-1], month)
+    tran_var.to_netcdf(path=save_path_var, mode='w', format='NETCDF4')
+
+# Significance needs every sample rather than the accumulated moments, so all
+# years are read again. Coastal means are small enough to hold in memory.
+if n_resamples > 0:
+    print('Calculating p-values from {} resamples.'.format(n_resamples))
+    perturbations = []
+    for year in years:
+        perturbations.append(open_year(transect_path(year)[0]).load())
+
+    with instrument.stage('significance', n_resamples=n_resamples, workers=workers):
+        p_value = significance.p_values(
+            xr.concat(perturbations, dim='time'), n_resamples=n_resamples, workers=workers
+        )
+
+    save_path_p = base_dir + '/transect_means/{}_goulburn_{}-{}_{}_p_value.nc'.format(file_prepend, years[0], years[-1], month)
+    p_value.to_netcdf(path=save_path_p, mode='w', format='NETCDF4')
+
+# Local solar time depends on the longitude of each point rather than the hour
+# of day, so all years are read again. Each point of the full transects is
+# binned at its own local solar time before the bin sums and counts are
+# summed along the coast and over years.
+if args.lst:
+    print('Calculating local solar time composite.')
+    total = {}
+    count = {}
+    dtypes = {}
+    for year in years:
+        tran_i = open_year(transect_path(year)[0], mean=False)
+        longitude = transect_longitude(tran_i)
+        with instrument.stage('lst_composite', year=year):
+            for name, da in tran_i.data_vars.items():
+                if 'time' not in da.dims:
+                    continue
+                composite = ta.lst_composite(da, longitude, bin_width=args.lst_bin)
+                n = xr.DataArray(composite['n_samples'].values, dims=composite.dims)
+                weighted = composite.drop_vars('n_samples').where(n > 0, 0) * n
+                total[name] = total.get(name, 0) + coastal_sum(weighted)
+                count[name] = count.get(name, 0) + coastal_sum(n)
+                dtypes[name] = composite.dtype
 
-    tran_list[i] = tran_i
-    
-tran = xr.concat(tuple(tran_list), dim = 'time')
+    tran_lst = xr.Dataset({
+        name : (total[name] / count[name].where(count[name] > 0)).astype(dtypes[name])
+            .assign_coords(n_samples=count[name])
+        for name in total
+    })
 
-tran_mean = tran.groupby('time.hour').mean('time')
+    save_path_lst = base_dir + '/transect_means/{}_goulburn_{}-{}_{}_lst.nc'.format(file_prepend, years[0], years[-1], month)
+    tran_lst.to_netcdf(path=save_path_lst, mode='w', format='NETCDF4')
 
-save_path = '/g/data/w40/esh563/goulburn_NT/transect_means/{}_goulburn_{}-{}_{}.nc'.format(file_prepend, years[0], years[-1], month)
-tran_mean.to_netcdf(path=save_path, mode='w', format='NETCDF4')
+instrument.finish()
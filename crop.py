@@ -0,0 +1,132 @@
+# Core
+import argparse
+import concurrent.futures
+import os
+import traceback
+
+# Analysis
+import xarray as xr
+from manifest import Manifest, atomic_output
+
+source_dir = '/g/data/ua8/ARCCSS_Data/MCASClimate/v1-0'
+base_dir = '/g/data/w40/esh563/goulburn_NT'
+
+# Goulburn domain and the lowest 71 model levels
+region = {'latitude' : slice(-12.5, -8.0), 'longitude' : slice(133.0, 136.0)}
+levels = slice(0, 71)
+
+def crop_paths(folder, var, years=range(2005, 2015), month=12, days=31):
+    """
+    List (original, cropped) daily file pairs for a WRF variable.
+    """
+
+    pairs = []
+    for year in years:
+        season = '{}{}'.format(year, year + 1)
+        for day in range(1, days + 1):
+            date = '{}{:02d}{:02d}'.format(year, month, day)
+            original = source_dir + '/{}/{}/{}_WRF_Maritime_Continent_4km_{}.nc'.format(season, folder, var, date)
+            cropped = base_dir + '/{}/{}/{}_goulburn_{}.nc'.format(season, folder, var, date)
+            pairs.append((original, cropped))
+
+    return pairs
+
+def region_for(ds):
+    """
+    Return the region as slices in the order of the file's coordinates, which may descend.
+    """
+
+    slices = {}
+    for dim, bounds in region.items():
+        values = ds[dim].values
+        if values.size > 1 and values[0] > values[-1]:
+            bounds = slice(bounds.stop, bounds.start)
+        slices[dim] = bounds
+
+    return slices
+
+def encoding_for(ds, complevel=1):
+    """
+    Compress each variable and chunk it by single time steps of the full cropped field.
+    """
+
+    encoding = {}
+    for name, da in ds.data_vars.items():
+        if da.ndim == 0 or da.dtype.kind not in 'fiu':
+            continue
+        chunksizes = tuple(1 if dim == 'time' else size for dim, size in zip(da.dims, da.shape))
+        encoding[name] = {'zlib' : True, 'complevel' : complevel, 'chunksizes' : chunksizes}
+
+    return encoding
+
+def crop_file(original, cropped):
+    """
+    Read only the Goulburn hyperslab of a file and write it with an unlimited time dimension.
+    """
+
+    ds = xr.open_dataset(original)
+    ds = ds.sel(**region_for(ds))
+    if 'level' in ds.dims:
+        ds = ds.isel(level=levels)
+
+    # Drop the source layout so the new chunking applies
+    for name in ds.variables:
+        for key in ['chunksizes', 'contiguous', 'original_shape']:
+            ds[name].encoding.pop(key, None)
+
+    os.makedirs(os.path.dirname(cropped), exist_ok=True)
+    with atomic_output(cropped) as tmp_path:
+        ds.to_netcdf(
+            path=tmp_path, mode='w', format='NETCDF4',
+            unlimited_dims=['time'], encoding=encoding_for(ds)
+        )
+    ds.close()
+
+    return cropped
+
+def crop(pairs, workers=1, force=False):
+    """
+    Crop files on a process pool, skipping those already cropped from unchanged originals.
+    """
+
+    manifest = Manifest(base_dir + '/crop_manifest.json')
+    params = {
+        'latitude' : [region['latitude'].start, region['latitude'].stop],
+        'longitude' : [region['longitude'].start, region['longitude'].stop],
+        'levels' : [levels.start, levels.stop],
+    }
+
+    todo = [
+        (original, cropped) for original, cropped in pairs
+        if os.path.exists(original) and (force or not manifest.is_current(cropped, [original], params))
+    ]
+    print('Cropping {} of {} files.'.format(len(todo), len(pairs)))
+
+    failed = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(crop_file, *pair) : pair for pair in todo}
+        for future in concurrent.futures.as_completed(futures):
+            original, cropped = futures[future]
+            try:
+                future.result()
+                manifest.record(cropped, [original], params)
+            except Exception:
+                traceback.print_exc()
+                failed.append(original)
+
+    return failed
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Crop daily WRF files to the Goulburn domain.')
+    parser.add_argument('folder')
+    parser.add_argument('var')
+    parser.add_argument('--years', nargs='+', type=int, default=list(range(2005, 2015)))
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--force', action='store_true', help='crop files that are up to date')
+    args = parser.parse_args()
+
+    failed = crop(crop_paths(args.folder, args.var, args.years), workers=args.workers, force=args.force)
+
+    for original in failed:
+        print('Failed ' + original)
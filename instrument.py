@@ -0,0 +1,291 @@
+# Core
+import contextlib
+import cProfile
+import datetime
+import io
+import json
+import os
+import pstats
+import resource
+import sys
+import time
+
+# Reports are written only when a run is started, for example by setting
+# GOULBURN_REPORT_DIR for the scripts that call start_from_env. Stages are
+# recorded where the work is computed, so lazy dask graphs are timed in the
+# stage that writes or computes them.
+
+# Reports started in this process. Stages are recorded in the innermost, so a
+# unit run in the parent process reports separately from the run around it.
+_reports = []
+
+def _io_bytes():
+    """
+    Return bytes read and written by this process, or None where /proc is unavailable.
+    """
+
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['read_bytes']), int(counters['write_bytes'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def _status_bytes(field):
+    """
+    Return a memory field of /proc/self/status, e.g. VmRSS or VmHWM, in bytes, or None where it is unavailable.
+    """
+
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+def _reset_peak_rss():
+    """
+    Reset the peak RSS of this process so the next reading covers only what follows.
+
+    Returns False where the kernel does not support it.
+    """
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def _peak_rss():
+    """
+    Return the peak resident set size of this process and its waited children in bytes.
+    """
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == 'darwin' else 1024
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+    return max(self_rss, children_rss) * scale
+
+class _TaskCounter:
+    """
+    Count dask tasks executed by the local schedulers.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.callback = None
+        try:
+            from dask.callbacks import Callback
+        except ImportError:
+            return
+
+        counter = self
+
+        class _Callback(Callback):
+            def _posttask(self, key, result, dsk, state, id):
+                counter.count += 1
+
+        self.callback = _Callback()
+
+    def __enter__(self):
+        if self.callback is not None:
+            self.callback.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        if self.callback is not None:
+            self.callback.__exit__(*args)
+
+class RunReport:
+    """
+    Per stage wall time, memory, bytes read and written and dask task counts for one run.
+
+    Each stage records its resident set size at the start and end and, on
+    Linux, its own peak. The peak is reset at the start of every stage and
+    folded into the stages around it, so nested stages report correctly.
+    """
+
+    def __init__(self, name, path=None, profile=None):
+        self.name = name
+        self.path = path
+        self.profile = set(profile or [])
+        self.started = datetime.datetime.now().isoformat()
+        self.stages = []
+        self._start = time.perf_counter()
+        # Running peaks of the open stages, innermost last
+        self._peaks = []
+        # Resetting the peak also lowers ru_maxrss, so the process peak is kept here
+        self._process_peak = 0
+
+    def _fold_peak(self):
+        """
+        Fold the peak RSS since the last reset into the open stages and process peak of every report.
+
+        Any report in the process may reset the peak next, so all are updated.
+        """
+
+        peak = _status_bytes('VmHWM')
+        if peak is None:
+            return
+        for report in set(_reports) | {self}:
+            report._peaks = [max(p, peak) for p in report._peaks]
+            report._process_peak = max(report._process_peak, peak)
+
+    def process_peak_rss(self):
+        """
+        Peak RSS of the process and its waited children over the run so far.
+        """
+
+        self._fold_peak()
+
+        return max(_peak_rss(), self._process_peak)
+
+    @contextlib.contextmanager
+    def stage(self, name, **info):
+        """
+        Record a stage. Stages listed in profile are also run under cProfile.
+        """
+
+        io_start = _io_bytes()
+        rss_start = _status_bytes('VmRSS')
+        self._fold_peak()
+        resettable = _reset_peak_rss()
+        self._peaks.append(0)
+        start = time.perf_counter()
+        profiler = cProfile.Profile() if name in self.profile else None
+
+        with _TaskCounter() as tasks:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                yield
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                wall_time = time.perf_counter() - start
+                self._fold_peak()
+                stage_peak = self._peaks.pop()
+
+        record = {
+            'stage' : name,
+            'wall_time' : wall_time,
+            # Peak over the life of the process so far, not of this stage alone
+            'process_peak_rss' : self.process_peak_rss(),
+            'dask_tasks' : tasks.count,
+        }
+        rss_end = _status_bytes('VmRSS')
+        if rss_start is not None and rss_end is not None:
+            record['rss_start'] = rss_start
+            record['rss_end'] = rss_end
+            record['rss_change'] = rss_end - rss_start
+        if resettable:
+            record['stage_peak_rss'] = stage_peak
+        io_end = _io_bytes()
+        if io_start is not None and io_end is not None:
+            record['bytes_read'] = io_end[0] - io_start[0]
+            record['bytes_written'] = io_end[1] - io_start[1]
+        if profiler is not None:
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(30)
+            record['profile'] = out.getvalue()
+        record.update(info)
+
+        self.stages.append(record)
+
+    def to_dict(self):
+        return {
+            'name' : self.name,
+            'started' : self.started,
+            'wall_time' : time.perf_counter() - self._start,
+            'process_peak_rss' : self.process_peak_rss(),
+            'argv' : sys.argv,
+            'pid' : os.getpid(),
+            'stages' : self.stages,
+        }
+
+    def save(self, path=None):
+        """
+        Write the report as JSON.
+        """
+
+        path = path or self.path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=1, default=str)
+
+def start(name, path=None, profile=None):
+    """
+    Start recording stages for this process and return the report.
+    """
+
+    report = RunReport(name, path, profile)
+    _reports.append(report)
+
+    return report
+
+def finish():
+    """
+    Save and stop the current report.
+    """
+
+    if not _reports:
+        return None
+
+    report = _reports.pop()
+    if report.path is not None:
+        report.save()
+
+    return report
+
+def stage(name, **info):
+    """
+    Record a stage in the current report, or do nothing if no report was started.
+    """
+
+    if not _reports:
+        return contextlib.nullcontext()
+
+    return _reports[-1].stage(name, **info)
+
+def report_path(name, directory):
+    """
+    Return a time stamped path for a run report.
+    """
+
+    stamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+
+    return os.path.join(directory, '{}_{}_{}.json'.format(name, stamp, os.getpid()))
+
+def start_from_env(name):
+    """
+    Start a report if GOULBURN_REPORT_DIR is set, profiling the stages listed in GOULBURN_PROFILE.
+
+    Worker processes inherit the environment, so each writes its own report.
+    """
+
+    directory = os.environ.get('GOULBURN_REPORT_DIR')
+    if not directory:
+        return None
+
+    profile = [s for s in os.environ.get('GOULBURN_PROFILE', '').split(',') if s]
+
+    return start(name, path=report_path(name, directory), profile=profile)
+
+@contextlib.contextmanager
+def run_report(name):
+    """
+    Record a report for the block if GOULBURN_REPORT_DIR is set, saving it even if the block fails.
+    """
+
+    report = start_from_env(name)
+    try:
+        yield report
+    finally:
+        if report is not None:
+            finish()
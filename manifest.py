@@ -0,0 +1,106 @@
+# Core
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+
+def fingerprint(path, checksum=False):
+    """
+    Describe a file by size and modification time, and optionally its sha256.
+    """
+
+    stat = os.stat(path)
+    fp = {'size' : stat.st_size, 'mtime' : stat.st_mtime}
+
+    if checksum:
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2 ** 20), b''):
+                h.update(block)
+        fp['sha256'] = h.hexdigest()
+
+    return fp
+
+@contextlib.contextmanager
+def atomic_output(path):
+    """
+    Yield a temporary path next to path, moved into place only if the block succeeds.
+
+    The temporary path may be a file or a directory.
+    """
+
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, '.{}.{}.tmp'.format(name, os.getpid()))
+
+    try:
+        yield tmp_path
+        # Directory stores such as Zarr cannot be replaced in one step
+        if os.path.isdir(tmp_path) and os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+class Manifest:
+    """
+    Record of the input fingerprints and parameters behind each output file.
+
+    An output is up to date if it exists and was recorded from the same inputs,
+    unchanged since, with the same parameters. Only one process should record
+    into a given manifest.
+    """
+
+    def __init__(self, path, checksum=False):
+        self.path = path
+        self.checksum = checksum
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def is_current(self, output, inputs, params=None):
+        """
+        Return True if output was recorded from the current inputs and params.
+        """
+
+        entry = self.entries.get(output)
+        if entry is None or not os.path.exists(output):
+            return False
+
+        # Round trip params through json so tuples and lists compare equal
+        if entry['params'] != json.loads(json.dumps(params)):
+            return False
+        if sorted(entry['inputs']) != sorted(inputs):
+            return False
+
+        try:
+            return all(
+                entry['inputs'][path] == fingerprint(path, self.checksum) for path in inputs
+            )
+        except FileNotFoundError:
+            return False
+
+    def record(self, output, inputs, params=None):
+        """
+        Record the inputs and params of a completed output and save the manifest.
+        """
+
+        self.entries[output] = {
+            'inputs' : {path : fingerprint(path, self.checksum) for path in inputs},
+            'params' : json.loads(json.dumps(params)),
+        }
+        self.save()
+
+    def save(self):
+        """
+        Write the manifest atomically.
+        """
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with atomic_output(self.path) as tmp_path:
+            with open(tmp_path, 'w') as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
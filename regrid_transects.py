@@ -0,0 +1,61 @@
+# Core
+import argparse
+
+# Analysis
+import numpy as np
+import transect_analysis as ta
+import run_transects as rt
+import storage
+from manifest import Manifest, atomic_output
+
+# Fixed heights in metres spanning the lowest 71 model levels
+HEIGHTS = np.arange(100, 15001, 100)
+
+def regrid_month(variable, year, month, heights, manifest, store='netcdf', force=False):
+    """
+    Regrid one month of WRF transects from model levels to fixed heights using the Z transects.
+
+    The Z transects are written by run_transects.py --products WRF --variables Z
+    from daily Z files cropped with sh subset.sh Z Z, as in subset_and_transect.sh.
+    """
+
+    tran_path = storage.find_intermediate(rt.save_path('WRF', variable, year, month))
+    z_path = storage.find_intermediate(rt.save_path('WRF', 'Z', year, month))
+    save_path = rt.save_path('WRF', variable + '_z', year, month, store)
+
+    inputs = [tran_path, z_path]
+    params = {'variable' : variable, 'heights' : heights.tolist(), 'store' : store}
+    if not force and manifest.is_current(save_path, inputs, params):
+        print('Up to date {} {}-{:02d}'.format(variable, year, month))
+        return
+
+    print('Regridding {} {}-{:02d}'.format(variable, year, month))
+
+    tran = storage.open_intermediate(tran_path, chunks={'time' : ta.TIME_CHUNK})
+    z = storage.open_intermediate(z_path, chunks={'time' : ta.TIME_CHUNK}).Z
+
+    regridded = ta.regrid_vertical(tran, z, heights)
+
+    with atomic_output(save_path) as tmp_path:
+        storage.write_intermediate(regridded, tmp_path, store=store)
+    manifest.record(save_path, inputs, params)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Regrid WRF transects from model levels to fixed heights.')
+    parser.add_argument('--variables', nargs='+', default=['wind_proj', 'W', 'T', 'clouds'])
+    parser.add_argument('--years', nargs='+', type=int, default=list(range(2005, 2015)))
+    parser.add_argument('--heights', nargs='+', type=float, default=None, help='target heights in metres')
+    parser.add_argument('--store', default='netcdf', choices=storage.STORES, help='format of the regridded files')
+    parser.add_argument('--force', action='store_true', help='regrid months that are up to date')
+    args = parser.parse_args()
+
+    heights = HEIGHTS if args.heights is None else np.array(args.heights)
+    manifest = Manifest(rt.manifest_path)
+
+    for year in args.years:
+        for variable in args.variables:
+            regrid_month(
+                variable, year, rt.PRODUCTS['WRF']['month'], heights, manifest,
+                store=args.store, force=args.force
+            )
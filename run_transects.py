@@ -0,0 +1,518 @@
+# Core
+import argparse
+import calendar
+import contextlib
+import concurrent.futures
+import glob
+import os
+import traceback
+
+# Analysis
+import xarray as xr
+import numpy as np
+import dask
+import transect_analysis as ta
+import storage
+import instrument
+from manifest import Manifest, atomic_output
+
+# Specify start and end coords on coast.
+# Choose order so that (transect_axis, coastline_axis) forms a right hand coordinate system
+lon0 = 134.5293
+lat0 = -12.4715
+coast_lon1 = 133.3290
+coast_lat1 = -12.1468
+distance = 453300
+
+# Transect families: coastline segment, transect length and optional spacing
+# per product overriding the product spacing. Families run together share
+# one read of each source file. The family name replaces goulburn in file names.
+FAMILIES = {
+    'goulburn' : {
+        'coast' : (lon0, lat0, coast_lon1, coast_lat1),
+        'distance' : distance,
+        'spacing' : {},
+    },
+}
+
+base_dir = '/g/data/w40/esh563/goulburn_NT'
+cache_dir = base_dir + '/cache'
+manifest_path = base_dir + '/transects/manifest.json'
+levels_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'average_model_levels.txt')
+
+# WRF variables: (folder, file prefix, variable name or None for all variables)
+WRF_VARIABLES = {
+    'U' : ('U', 'U', 'U'),
+    'V' : ('V', 'V', 'V'),
+    'W' : ('W', 'W', 'W'),
+    'PRCP' : ('PRCP', 'prcp', 'RAINNC'),
+    'T' : ('T', 'theta', 'T'),
+    'clouds' : ('clouds_daily', 'clouds', None),
+    # Height of each model level in metres, for regrid_transects.py. Cropped
+    # from the Z folder of the source dataset with sh subset.sh Z Z
+    'Z' : ('Z', 'Z', 'Z'),
+}
+
+# Monthly files or stores written by combine_liquid_water.py --monthly: (folder, file prefix).
+# Where one exists it is read instead of the daily files.
+WRF_MONTHLY = {
+    'clouds' : ('clouds_monthly', 'clouds'),
+}
+
+def WRF_path(variable, year, month):
+    """
+    Return the glob pattern of a month of a cropped WRF variable.
+    """
+
+    folder, prefix, name = WRF_VARIABLES[variable]
+
+    return base_dir + '/{0}{1}/{2}/{3}_goulburn_{0}{4:02d}*.nc'.format(year, year + 1, folder, prefix, month)
+
+def WRF_monthly_path(variable, year, month):
+    """
+    Return the monthly file or store of a WRF variable, or None if there is none.
+    """
+
+    if variable not in WRF_MONTHLY:
+        return None
+
+    folder, prefix = WRF_MONTHLY[variable]
+    path = storage.find_intermediate(
+        base_dir + '/{0}{1}/{2}/{3}_goulburn_{0}{4:02d}.nc'.format(year, year + 1, folder, prefix, month)
+    )
+
+    return path if os.path.exists(path) else None
+
+def WRF_variable_inputs(variable):
+    """
+    Return the WRF variables read to calculate a transect variable.
+    """
+
+    return ['U', 'V'] if variable == 'wind_proj' else [variable]
+
+def WRF_inputs(variables, year, month):
+    """
+    List the files read to calculate WRF transect variables.
+    """
+
+    raw = set(v for variable in variables for v in WRF_variable_inputs(variable))
+
+    paths = []
+    for v in raw:
+        monthly = WRF_monthly_path(v, year, month)
+        paths += [monthly] if monthly is not None else glob.glob(WRF_path(v, year, month))
+
+    return sorted(paths)
+
+def open_WRF_variable(variable, year, month):
+    """
+    Open a month of a cropped WRF variable.
+    """
+
+    name = WRF_VARIABLES[variable][2]
+    monthly = WRF_monthly_path(variable, year, month)
+    if monthly is not None:
+        ds = storage.open_intermediate(monthly, chunks={'time': ta.TIME_CHUNK})
+    else:
+        ds = xr.open_mfdataset(WRF_path(variable, year, month), concat_dim = 'time', combine = 'nested', chunks={'time': ta.TIME_CHUNK})
+
+    if name is not None:
+        ds = ds[name]
+    if 'level' in ds.dims:
+        ds = ds.assign_coords(level = np.loadtxt(levels_path)[0:ds.level.size])
+
+    return ds
+
+def read_WRF(variables, year, month, geometries, mode='full', skipna=False):
+    """
+    Return transects of several WRF variables for each family from a single pass over the month.
+    
+    All variables and families share one interpolation operator. The wind is
+    projected onto each family's transects after interpolation, on the much
+    smaller transect arrays; both steps are linear so the result is unchanged.
+    Full transects of variables on model levels carry the terrain height 
+    under each point as the terrain_height coordinate.
+    """
+
+    raw = []
+    for variable in variables:
+        for v in WRF_variable_inputs(variable):
+            if v not in raw:
+                raw.append(v)
+
+    # Record which output variables each input provides
+    opened = [open_WRF_variable(v, year, month) for v in raw]
+    names = {
+        v : [ds.name] if isinstance(ds, xr.DataArray) else list(ds.data_vars)
+        for v, ds in zip(raw, opened)
+    }
+
+    # Variables are cropped to the same grid, so use the first file's coordinates
+    trans = ta.calc_transect_families(xr.merge(opened, join='override'), geometries, mode=mode, skipna=skipna)
+
+    families = {}
+    for family, tran in trans.items():
+        # Terrain height under full transects, memory mapped from the static cache shared by workers
+        terrain = geometries[family].static_transects().HGT if mode == 'full' else None
+
+        families[family] = {}
+        for variable in variables:
+            if variable == 'wind_proj':
+                tran_v = geometries[family].project(tran.U, tran.V).rename('wind_proj')
+            else:
+                tran_v = tran[names[variable]]
+            if terrain is not None and 'level' in tran_v.dims:
+                tran_v = tran_v.assign_coords(terrain_height=(terrain.dims, terrain.values))
+            families[family][variable] = tran_v
+
+    return families
+
+def CMORPH_inputs(variables, year, month):
+    """
+    List the CMORPH file covering a month.
+    """
+
+    days = calendar.monthrange(year, month)[1]
+    path = '/g/data/ua8/CMORPH/CMORPH_V1.0/netcdf/{0}/pr_30min_CMORPH_V1_{0}{1:02d}01_{0}{1:02d}{2}.nc'.format(
+        year, month, days
+    )
+
+    return [path]
+
+def read_CMORPH(variables, year, month, geometries, mode='full', skipna=False):
+    """
+    Return transects of a month of 30 minute CMORPH precipitation for each family.
+    """
+
+    CMORPH = xr.open_dataset(CMORPH_inputs(variables, year, month)[0], chunks={'time': ta.TIME_CHUNK})\
+        .sel(lat = slice(-12.6, -8), lon = slice(132.8, 136.2))\
+        .rename({'lat' : 'latitude', 'lon' : 'longitude'})
+    trans = ta.calc_transect_families(CMORPH[list(variables)], geometries, mode=mode, skipna=skipna)
+
+    return {
+        family : {variable : tran[variable] for variable in variables} for family, tran in trans.items()
+    }
+
+def TRMM_3B42_inputs(variables, year, month):
+    """
+    List the subset TRMM 3B42 file of a month.
+    """
+
+    return [base_dir + '/TRMM_3B42/TRMM_3B42_goulburn_{}{:02d}.nc'.format(year, month)]
+
+def read_TRMM_3B42(variables, year, month, geometries, mode='full', skipna=False):
+    """
+    Return transects of a month of subset TRMM 3B42 precipitation for each family.
+    """
+
+    TRMM_3B42 = xr.open_dataset(TRMM_3B42_inputs(variables, year, month)[0], chunks={'time': ta.TIME_CHUNK})
+    trans = ta.calc_transect_families(TRMM_3B42[list(variables)], geometries, mode=mode, skipna=skipna)
+
+    return {
+        family : {variable : tran[variable] for variable in variables} for family, tran in trans.items()
+    }
+
+# Registry of products: transect spacing, variables, default month, input files, reader and output file name.
+# Optional variables run only when asked for with --variables. Products with
+# missing data skip missing values in along coast means.
+PRODUCTS = {
+    'WRF' : {
+        'spacing' : 25000,
+        'variables' : ['wind_proj', 'W', 'PRCP', 'T', 'clouds'],
+        'optional' : ['Z'],
+        'missing_data' : False,
+        'month' : 12,
+        'inputs' : WRF_inputs,
+        'reader' : read_WRF,
+        'save_name' : '{variable}_{family}_{year}{month:02d}.nc',
+    },
+    'CMORPH' : {
+        'spacing' : 8*10**3,
+        'variables' : ['pr'],
+        'missing_data' : True,
+        'month' : 11,
+        'inputs' : CMORPH_inputs,
+        'reader' : read_CMORPH,
+        'save_name' : 'CMORPH_{family}_{year}{month:02d}.nc',
+    },
+    'TRMM_3B42' : {
+        'spacing' : 25000,
+        'variables' : ['precipitation'],
+        'missing_data' : True,
+        'month' : 12,
+        'inputs' : TRMM_3B42_inputs,
+        'reader' : read_TRMM_3B42,
+        'save_name' : 'TRMM_3B42_{family}_{year}{month:02d}.nc',
+    },
+}
+
+def family_spacing(product, family):
+    """
+    Return the transect spacing of a product in a family.
+    """
+
+    return FAMILIES[family]['spacing'].get(product, PRODUCTS[product]['spacing'])
+
+def get_geometry(product, family='goulburn'):
+    """
+    Return the transect geometry used for a product and family.
+    """
+
+    return ta.TransectGeometry.create(
+        *FAMILIES[family]['coast'], FAMILIES[family]['distance'],
+        spacing = family_spacing(product, family), cache_dir=cache_dir
+    )
+
+def get_geometries(product, families=('goulburn',)):
+    """
+    Return the geometries of several families for a product.
+    """
+
+    return {family : get_geometry(product, family) for family in families}
+
+def save_path(product, variable, year, month, store='netcdf', family='goulburn', mode='full'):
+    """
+    Return the transect file of a product variable for one month and family.
+
+    Files from modes other than full, such as coastal_mean, are suffixed with the mode.
+    """
+
+    name = PRODUCTS[product]['save_name'].format(variable=variable, year=year, month=month, family=family)
+    name = os.path.splitext(name)[0]
+    if mode != 'full':
+        name += '_' + mode
+    name += storage.store_suffix(store)
+
+    return base_dir + '/transects/' + name
+
+def make_units(products, variables=None, years=range(2005, 2015), months=None, fused=False):
+    """
+    List the independent (product, variables, year, month) units to run.
+    
+    Each unit normally holds one variable. With fused set, all variables of a
+    product and month form one unit and are read in a single pass. Optional
+    variables, such as the WRF level heights, are included only if listed in
+    variables.
+    """
+
+    units = []
+    for product in products:
+        product_variables = PRODUCTS[product]['variables']
+        if variables is not None:
+            product_variables = [
+                v for v in product_variables + PRODUCTS[product].get('optional', []) if v in variables
+            ]
+        product_months = months or [PRODUCTS[product]['month']]
+        if fused:
+            groups = [tuple(product_variables)]
+        else:
+            groups = [(variable,) for variable in product_variables]
+        for group in groups:
+            for year in years:
+                for month in product_months:
+                    units.append((product, group, year, month))
+
+    return units
+
+def unit_skipna(product, mode='full', skipna=False):
+    """
+    Return whether along coast means of a product skip missing values.
+    """
+
+    return mode != 'full' and (skipna or PRODUCTS[product]['missing_data'])
+
+def unit_params(product, variable, store, family='goulburn', mode='full', skipna=False):
+    """
+    Return the parameters that an output of a product variable depends on.
+    """
+
+    params = {
+        'product' : product, 'variable' : variable, 'store' : store,
+        'coast' : list(FAMILIES[family]['coast']),
+        'distance' : FAMILIES[family]['distance'], 'spacing' : family_spacing(product, family),
+    }
+    if mode != 'full':
+        params['mode'] = mode
+        params['skipna'] = unit_skipna(product, mode, skipna)
+
+    return params
+
+def unit_outputs(unit, store='netcdf', families=('goulburn',), mode='full', skipna=False):
+    """
+    List the (output, inputs, params) of every file a unit writes.
+    """
+
+    product, variables, year, month = unit
+    inputs = PRODUCTS[product]['inputs']
+
+    return [
+        (
+            save_path(product, v, year, month, store, family, mode), inputs((v,), year, month), 
+            unit_params(product, v, store, family, mode, skipna)
+        )
+        for family in families for v in variables
+    ]
+
+def is_current(unit, manifest, store='netcdf', families=('goulburn',), mode='full', skipna=False):
+    """
+    Check whether every output of a unit is up to date with its inputs.
+    """
+
+    return all(
+        manifest.is_current(output, inputs, params) 
+        for output, inputs, params in unit_outputs(unit, store, families, mode, skipna)
+    )
+
+def record(unit, manifest, store='netcdf', families=('goulburn',), mode='full', skipna=False):
+    """
+    Record the outputs of a completed unit.
+    """
+
+    for output, inputs, params in unit_outputs(unit, store, families, mode, skipna):
+        manifest.record(output, inputs, params)
+
+def describe(unit):
+    """
+    Format a unit for progress messages.
+    """
+
+    product, variables, year, month = unit
+
+    return '{} {} {}-{:02d}'.format(product, ' '.join(variables), year, month)
+
+def run_unit(unit, store='netcdf', families=('goulburn',), mode='full', skipna=False):
+    """
+    Calculate and save the transects of every family for one unit in the given store.
+
+    In coastal_mean mode only the along coast mean of each family is computed
+    and saved. The mean skips missing values if skipna is set or the product
+    has missing data.
+    """
+
+    product, variables, year, month = unit
+    name = '{}_{}_{}{:02d}'.format(product, '_'.join(variables), year, month)
+
+    with instrument.run_report(name):
+        with instrument.stage('geometry'):
+            geometries = get_geometries(product, families)
+
+        # Reading is lazy, so reads and interpolation are timed in the write stage
+        families_trans = PRODUCTS[product]['reader'](
+            variables, year, month, geometries, mode=mode, skipna=unit_skipna(product, mode, skipna)
+        )
+
+        paths = []
+        trans = []
+        for family, family_trans in families_trans.items():
+            for variable, tran in family_trans.items():
+                paths.append(save_path(product, variable, year, month, store, family, mode))
+                trans.append(tran)
+
+        # Write every variable in one computation so shared reads happen once.
+        # Files are written to temporary paths and only moved into place on success.
+        os.makedirs(base_dir + '/transects', exist_ok=True)
+        with instrument.stage('write', variables=list(variables), families=len(geometries), store=store):
+            with contextlib.ExitStack() as stack:
+                tmp_paths = [stack.enter_context(atomic_output(path)) for path in paths]
+                writes = [
+                    storage.write_intermediate(tran, tmp_path, store=store, compute=False)
+                    for tran, tmp_path in zip(trans, tmp_paths)
+                ]
+                dask.compute(*writes)
+
+    return unit
+
+def init_worker():
+    """
+    Run dask graphs serially inside pool workers, so the pool sets the parallelism.
+    """
+
+    dask.config.set(scheduler='synchronous')
+
+def run(units, workers=1, force=False, store='netcdf', families=('goulburn',), mode='full', skipna=False):
+    """
+    Run units on a process pool, returning those that failed.
+    
+    Every unit writes the outputs of all families from one read. Units whose
+    outputs are recorded in the manifest as up to date are skipped unless 
+    force is set. Completed units are recorded by this process only.
+    """
+
+    manifest = Manifest(manifest_path)
+    if not force:
+        with instrument.stage('manifest', units=len(units)):
+            skipped = [unit for unit in units if is_current(unit, manifest, store, families, mode, skipna)]
+            units = [unit for unit in units if unit not in skipped]
+        for unit in skipped:
+            print('Up to date ' + describe(unit))
+
+    # Locate the coast once so workers only load geometries from cache_dir
+    with instrument.stage('geometry'):
+        for product in sorted(set(unit[0] for unit in units)):
+            get_geometries(product, families)
+
+    failed = []
+
+    if workers == 1:
+        for unit in units:
+            print('Solving for ' + describe(unit))
+            try:
+                run_unit(unit, store, families, mode, skipna)
+                record(unit, manifest, store, families, mode, skipna)
+            except Exception:
+                traceback.print_exc()
+                failed.append(unit)
+        return failed
+
+    with instrument.stage('units', units=len(units), workers=workers), \
+        concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+        futures = {pool.submit(run_unit, unit, store, families, mode, skipna) : unit for unit in units}
+        for future in concurrent.futures.as_completed(futures):
+            unit = futures[future]
+            try:
+                future.result()
+                record(unit, manifest, store, families, mode, skipna)
+                print('Finished ' + describe(unit))
+            except Exception:
+                traceback.print_exc()
+                failed.append(unit)
+
+    return failed
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Calculate transects for each product, variable, year and month.')
+    parser.add_argument('--products', nargs='+', default=list(PRODUCTS), choices=list(PRODUCTS))
+    parser.add_argument('--variables', nargs='+', default=None)
+    parser.add_argument('--years', nargs='+', type=int, default=list(range(2005, 2015)))
+    parser.add_argument('--months', nargs='+', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--fused', action='store_true', help='read all variables of a month in one pass')
+    parser.add_argument('--force', action='store_true', help='recompute outputs that are up to date')
+    parser.add_argument('--store', default='netcdf', choices=storage.STORES, help='format of the transect files')
+    parser.add_argument('--families', nargs='+', default=['goulburn'], choices=list(FAMILIES), help='transect families sharing each read')
+    parser.add_argument('--mode', default='full', choices=['full', 'coastal_mean'], help='save every transect or only the along coast mean')
+    parser.add_argument('--skipna', action='store_true', help='skip missing values in along coast means of every product, not only those with missing data')
+    parser.add_argument('--report-dir', default=None, help='write a JSON timing report for the run and each unit here')
+    parser.add_argument('--profile', nargs='+', default=[], help='stages to run under cProfile in the reports')
+    args = parser.parse_args()
+
+    # Set through the environment so pool workers write their own reports
+    if args.report_dir is not None:
+        os.environ['GOULBURN_REPORT_DIR'] = args.report_dir
+        os.environ['GOULBURN_PROFILE'] = ','.join(args.profile)
+
+    units = make_units(args.products, args.variables, args.years, args.months, fused=args.fused)
+    print('Running {} units on {} workers.'.format(len(units), args.workers))
+
+    with instrument.run_report('run_transects'):
+        failed = run(
+            units, workers=args.workers, force=args.force, store=args.store, 
+            families=args.families, mode=args.mode, skipna=args.skipna
+        )
+
+    if failed:
+        print('Failed units:')
+        for unit in failed:
+            print('    ' + describe(unit))
+        raise SystemExit(1)
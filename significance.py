@@ -0,0 +1,137 @@
+# Core
+import concurrent.futures
+
+# Analysis
+import xarray as xr
+import numpy as np
+
+# Data shared with pool workers, set once per worker by _init_worker
+_shared = {}
+
+def hourly_samples(da, dim='time'):
+    """
+    Arrange a perturbation series as (day, hour, point) samples.
+
+    Values within the same day and hour, such as half hourly data, are
+    averaged. Returns the samples with NaN for missing values, and the
+    remaining dimensions and coordinates for labelling the result.
+    """
+
+    da = da.transpose(dim, ...)
+    time = da[dim].to_index()
+    days, day_index = np.unique(time.floor('D'), return_inverse=True)
+    hour = time.hour.values
+
+    values = da.values.reshape(time.size, -1)
+    valid = ~np.isnan(values)
+
+    total = np.zeros((days.size, 24, values.shape[1]))
+    count = np.zeros((days.size, 24, values.shape[1]))
+    np.add.at(total, (day_index, hour), np.where(valid, values, 0))
+    np.add.at(count, (day_index, hour), valid)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        samples = total / count
+
+    template = da.isel({dim : 0}, drop=True)
+
+    return samples, template
+
+def _init_worker(samples):
+    """
+    Keep the samples in each worker so they are sent only once.
+    """
+
+    _shared['samples'] = samples
+
+def _exceedances(streams, sizes, method):
+    """
+    Count resampled composites at least as far from zero as the observed composite.
+
+    Each batch of resamples is a (batch, day) weight matrix applied to the
+    (day, hour * point) samples in one matrix product, drawn from its own
+    stream. Sign flips give the permutation test; multinomial day counts
+    applied to the centred samples give the bootstrap test.
+    """
+
+    samples = _shared['samples']
+    n_day = samples.shape[0]
+    valid = ~np.isnan(samples.reshape(n_day, -1))
+    x = np.where(valid, samples.reshape(n_day, -1), 0).astype(np.float32)
+
+    count = valid.sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        observed = np.abs(x.sum(axis=0) / count)
+
+    if method == 'bootstrap':
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x = np.where(valid, x - x.sum(axis=0) / count, 0).astype(np.float32)
+
+    exceed = np.zeros(x.shape[1], dtype=np.int64)
+
+    for stream, size in zip(streams, sizes):
+        rng = np.random.default_rng(stream)
+        if method == 'permutation':
+            weights = rng.choice(np.array([-1, 1], dtype=np.float32), size=(size, n_day))
+            n = count
+        else:
+            weights = rng.multinomial(n_day, np.full(n_day, 1 / n_day), size=size).astype(np.float32)
+            n = weights @ valid.astype(np.float32)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            resampled = np.abs((weights @ x) / n)
+        # Allow for float32 rounding of resamples equal to the observed composite
+        exceed += (resampled >= observed * (1 - 1e-5)).sum(axis=0)
+
+    return exceed
+
+def p_values(
+    da, n_resamples=10000, method='permutation', workers=1, seed=0, batch_size=256, dim='time'
+):
+    """
+    Two sided p-values that the hourly composite of a perturbation series is zero.
+
+    Whole days are resampled, keeping the diurnal cycle of each day together,
+    and every hour and point is tested at once. Each batch of resamples
+    draws from its own stream spawned from seed and batches are split
+    between workers, so results depend on seed and batch_size but not on
+    the number of workers.
+    """
+
+    if method not in ['permutation', 'bootstrap']:
+        raise ValueError('Unknown method {}.'.format(method))
+
+    if isinstance(da, xr.Dataset):
+        return xr.Dataset({
+            name : p_values(v, n_resamples, method, workers, seed, batch_size, dim)
+            for name, v in da.data_vars.items() if dim in v.dims
+        })
+
+    samples, template = hourly_samples(da, dim)
+
+    sizes = [min(batch_size, n_resamples - start) for start in range(0, n_resamples, batch_size)]
+    streams = np.random.SeedSequence(seed).spawn(len(sizes))
+    workers = max(1, min(workers, len(sizes)))
+
+    if workers == 1:
+        _init_worker(samples)
+        exceed = _exceedances(streams, sizes, method)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(samples,)
+        ) as pool:
+            futures = [
+                pool.submit(_exceedances, [streams[i] for i in share], [sizes[i] for i in share], method)
+                for share in np.array_split(np.arange(len(sizes)), workers)
+            ]
+            exceed = sum(future.result() for future in futures)
+
+    count = (~np.isnan(samples)).sum(axis=0).reshape(-1)
+    p = np.where(count > 0, (exceed + 1) / (n_resamples + 1), np.nan)
+
+    p_value = xr.DataArray(
+        p.reshape((24,) + template.shape), dims=('hour',) + template.dims,
+        coords=template.coords, name='p_value'
+    ).assign_coords(hour=np.arange(24))
+    p_value.attrs = {'method' : method, 'n_resamples' : n_resamples, 'seed' : seed}
+
+    return p_value
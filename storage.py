@@ -0,0 +1,186 @@
+# Core
+import argparse
+import os
+
+# Analysis
+import xarray as xr
+import numpy as np
+
+# Formats for intermediate files: plain NetCDF4 as before, chunked and
+# compressed NetCDF4, or Zarr
+STORES = ['netcdf', 'compressed', 'zarr']
+
+# Target uncompressed size of one chunk
+CHUNK_BYTES = 16 * 2 ** 20
+
+def store_suffix(store):
+    """
+    Return the file suffix used by a store.
+    """
+
+    return '.zarr' if store == 'zarr' else '.nc'
+
+def steps_per_day(time):
+    """
+    Number of time steps in a day from the most common step, or 24 if it cannot be found.
+    """
+
+    time = np.asarray(time)
+    if time.size < 2 or not np.issubdtype(time.dtype, np.datetime64):
+        return 24
+
+    values, counts = np.unique(np.diff(time), return_counts=True)
+    step = values[np.argmax(counts)] / np.timedelta64(1, 's')
+    if step <= 0:
+        return 24
+
+    return max(1, int(round(86400 / step)))
+
+def time_chunks(da, chunk_bytes=CHUNK_BYTES):
+    """
+    Chunk sizes holding whole days along time and the full extent of every other dimension.
+
+    Whole days keep every hour equally represented in each chunk, which suits
+    hour of day compositing and 24 h running means. The length of a day is
+    taken from the time step, e.g. 48 steps for half hourly CMORPH.
+    """
+
+    sizes = dict(zip(da.dims, da.shape))
+    day = steps_per_day(da['time'].values) if 'time' in da.coords else 24
+    step_bytes = np.dtype(np.float32).itemsize * int(np.prod([s for d, s in sizes.items() if d != 'time']))
+    days = max(1, chunk_bytes // (day * step_bytes))
+    sizes['time'] = int(min(sizes['time'], day * days))
+
+    return sizes
+
+def zarr_encoding(chunks, complevel=4, digits=None):
+    """
+    Zarr encoding of one float variable, using the codec names of the installed zarr version.
+
+    zarr 2 takes a numcodecs compressor and filters, zarr 3 a tuple of
+    compressors and array to array filters.
+    """
+
+    import zarr
+    if int(zarr.__version__.split('.')[0]) < 3:
+        import numcodecs
+        filters = [numcodecs.Quantize(digits, dtype='<f4')] if digits is not None else None
+        return {
+            'dtype' : 'float32', 'chunks' : chunks, 'filters' : filters,
+            'compressor' : numcodecs.Blosc(cname='zstd', clevel=complevel, shuffle=numcodecs.Blosc.BITSHUFFLE),
+        }
+
+    from zarr.codecs import BloscCodec
+    encoding = {
+        'dtype' : 'float32', 'chunks' : chunks,
+        'compressors' : (BloscCodec(cname='zstd', clevel=complevel, shuffle='bitshuffle'),),
+    }
+    if digits is not None:
+        from zarr.codecs.numcodecs import Quantize
+        encoding['filters'] = (Quantize(digits=digits, dtype='<f4'),)
+
+    return encoding
+
+def encoding_policy(ds, store='compressed', complevel=4, digits=None):
+    """
+    Encoding for intermediate data variables: float32, compressed and chunked along time.
+
+    digits, if given, is the number of decimal places kept before compression.
+    Coordinates are written unchanged.
+    """
+
+    encoding = {}
+    for name, da in ds.data_vars.items():
+        if da.dtype.kind != 'f':
+            continue
+
+        chunks = time_chunks(da) if 'time' in da.dims else dict(zip(da.dims, da.shape))
+        chunks = tuple(chunks[d] for d in da.dims)
+
+        if store == 'zarr':
+            encoding[name] = zarr_encoding(chunks, complevel, digits)
+        else:
+            encoding[name] = {
+                'dtype' : 'float32', 'chunksizes' : chunks, 'zlib' : True, 'complevel' : complevel, 'shuffle' : True,
+            }
+            if digits is not None:
+                encoding[name]['least_significant_digit'] = digits
+
+    return encoding
+
+def write_intermediate(ds, path, store='netcdf', digits=None, append=False, compute=True):
+    """
+    Write an intermediate dataset in the given store.
+
+    With append set, a Zarr store that already exists is extended along time
+    so several months can share one consolidated store.
+    """
+
+    if isinstance(ds, xr.DataArray):
+        ds = ds.to_dataset()
+
+    if store == 'netcdf':
+        return ds.to_netcdf(path=path, mode='w', format='NETCDF4', compute=compute)
+
+    encoding = encoding_policy(ds, store, digits=digits)
+    unlimited_dims = ['time'] if 'time' in ds.dims else None
+
+    if store == 'compressed':
+        return ds.to_netcdf(
+            path=path, mode='w', format='NETCDF4', encoding=encoding,
+            unlimited_dims=unlimited_dims, compute=compute
+        )
+
+    if append and os.path.exists(path):
+        existing = xr.open_zarr(path, consolidated=True)
+        chunks = {}
+        for name in ds.data_vars:
+            if name in existing and 'chunks' in existing[name].encoding:
+                chunks.update(dict(zip(existing[name].dims, existing[name].encoding['chunks'])))
+        return ds.chunk(chunks).to_zarr(path, append_dim='time', consolidated=True, compute=compute)
+
+    # Dask chunks must line up with the Zarr chunks
+    if ds.chunks:
+        chunks = {}
+        for name, enc in encoding.items():
+            chunks.update(dict(zip(ds[name].dims, enc['chunks'])))
+        ds = ds.chunk(chunks)
+
+    return ds.to_zarr(path, mode='w', encoding=encoding, consolidated=True, compute=compute)
+
+def open_intermediate(path, chunks=None):
+    """
+    Open an intermediate file or store written by write_intermediate.
+    """
+
+    if path.endswith('.zarr'):
+        return xr.open_zarr(path, consolidated=True, chunks=chunks if chunks is not None else 'auto')
+
+    return xr.open_dataset(path, chunks=chunks)
+
+def find_intermediate(path):
+    """
+    Return path, or the Zarr store with the same name if only that exists.
+    """
+
+    zarr_path = os.path.splitext(path)[0] + '.zarr'
+    if not os.path.exists(path) and os.path.exists(zarr_path):
+        return zarr_path
+
+    return path
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Append monthly intermediate files to one consolidated Zarr store.')
+    parser.add_argument('store')
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--digits', type=int, default=None)
+    args = parser.parse_args()
+
+    # Append in time order
+    datasets = [open_intermediate(path, chunks={}) for path in args.paths]
+    datasets = sorted(datasets, key=lambda ds: ds.time.values[0])
+
+    for i, ds in enumerate(datasets):
+        print('Appending {}'.format(str(ds.time.values[0])[0:10]))
+        write_intermediate(ds, args.store, store='zarr', digits=args.digits, append=(i > 0))
@@ -2,5 +2,8 @@
 
 sh subset.sh V V
 sh subset.sh W W
+# Height of each model level, from the Z folder of the source dataset
+sh subset.sh Z Z
 
-python3 WRF_transect_UVW.py
+python3 run_transects.py --products WRF --variables wind_proj W Z
+python3 regrid_transects.py --variables wind_proj W
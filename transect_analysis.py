@@ -1,50 +1,837 @@
+# Core
+import hashlib
+import os
+import shutil
+
+# Analysis
 import pyproj as pp
 import xarray as xr
 import numpy as np
+import scipy.sparse as sparse
+import dask
+import instrument
+
+# Default number of time steps per dask chunk when streaming transects.
+TIME_CHUNK = 24
+
+# Static WRF fields used to locate the coastline.
+STATIC_PATH = '/g/data/ua8/ARCCSS_Data/MCASClimate/v1-0/static/static.nc'
+STATIC_VARIABLES = ['LANDMASK', 'HGT']
+
+# Region of the static fields searched for the coastline.
+COAST_REGION = {'latitude' : slice(-12.75, -6), 'longitude' : slice(130, 139)}
+
+# Operators and geometries already built in this process, keyed by hash.
+_operators = {}
+_geometries = {}
 
 def horizontal_tran_interp(ds, lon0, lat0, lon1, lat1, n):
     """
     Interpolate onto a transect.
+    
+    The n transect points are passed to interp as vectorized indexers sharing
+    the transect_axis dimension, so only the points themselves are evaluated
+    rather than the n by n grid of their longitudes and latitudes.
     """
     
-    lon = np.linspace(lon0, lon1, num=n)
-    lat = np.linspace(lat0, lat1, num=n)
-
-    LON, LAT = np.meshgrid(ds.longitude, ds.latitude);
-    interp_LON, interp_LAT = np.meshgrid(lon, lat);
+    lon = xr.DataArray(np.linspace(lon0, lon1, num=n), dims='transect_axis')
+    lat = xr.DataArray(np.linspace(lat0, lat1, num=n), dims='transect_axis')
     
     ds_interp = ds.interp(longitude=lon, latitude=lat)
-
-    ds_interp = ds_interp.isel(
-        longitude=xr.DataArray(
-            np.arange(0,np.size(lon)), 
-            dims='transect_axis'),
-        latitude=xr.DataArray(
-            np.arange(0,np.size(lon)), 
-            dims='transect_axis',)
-    )
     ds_interp = ds_interp.drop('longitude').drop('latitude')
     
     return ds_interp
 
-def calc_transects(ds, trans_lon0, trans_lat0, trans_lon1, trans_lat1, n_points, n_trans):
+def _axis_weights(grid, x):
+    """
+    Find bracketing indices and linear weights of x on a one dimensional grid.
+    """
+    
+    grid = np.asarray(grid, dtype=float)
+    order = np.argsort(grid)
+    g = grid[order]
+    
+    i = np.clip(np.searchsorted(g, x) - 1, 0, g.size - 2)
+    w = (x - g[i]) / (g[i + 1] - g[i])
+    outside = (x < g[0]) | (x > g[-1]) | np.isnan(x)
+    
+    return order[i], order[i + 1], w, outside
+
+class TransectOperator:
+    """
+    Sparse bilinear interpolation from a flattened (latitude, longitude) grid onto transect points.
+    """
+    
+    def __init__(self, matrix, outside, shape):
+        self.matrix = matrix
+        self.outside = outside
+        self.shape = tuple(shape)
+        
+    @classmethod
+    def build(cls, longitude, latitude, point_lon, point_lat):
+        """
+        Compute neighbour indices and weights for each transect point.
+        """
+        
+        point_lon = np.asarray(point_lon, dtype=float)
+        point_lat = np.asarray(point_lat, dtype=float)
+        
+        ix0, ix1, wx, outside_x = _axis_weights(longitude, point_lon.ravel())
+        iy0, iy1, wy, outside_y = _axis_weights(latitude, point_lat.ravel())
+        
+        n_lon = np.size(longitude)
+        n_samples = point_lon.size
+        
+        rows = np.tile(np.arange(n_samples), 4)
+        cols = np.concatenate([
+            iy0 * n_lon + ix0, iy0 * n_lon + ix1, iy1 * n_lon + ix0, iy1 * n_lon + ix1
+        ])
+        weights = np.concatenate([
+            (1 - wy) * (1 - wx), (1 - wy) * wx, wy * (1 - wx), wy * wx
+        ])
+        
+        matrix = sparse.csr_matrix(
+            (weights, (rows, cols)), shape=(n_samples, np.size(latitude) * n_lon)
+        )
+        
+        return cls(matrix, outside_x | outside_y, point_lon.shape)
+    
+    @classmethod
+    def load(cls, path):
+        """
+        Load an operator saved with save.
+        """
+        
+        f = np.load(path)
+        matrix = sparse.csr_matrix(
+            (f['data'], f['indices'], f['indptr']), shape=tuple(f['matrix_shape'])
+        )
+        
+        return cls(matrix, f['outside'], f['shape'])
+    
+    def save(self, path):
+        """
+        Save the operator as a compressed npz file.
+        """
+        
+        np.savez_compressed(
+            path, data=self.matrix.data, indices=self.matrix.indices, indptr=self.matrix.indptr,
+            matrix_shape=self.matrix.shape, outside=self.outside, shape=self.shape
+        )
+        
+    def reduce(self, reduction):
+        """
+        Return an operator giving weighted means over transects, e.g. along coast means.
+        
+        reduction is an (n_bands, n_trans) matrix of weights; a single row of
+        weights gives an operator of shape (n_points,). At each point, the
+        weights are renormalised over the transects inside the grid, matching
+        a mean that skips points outside the grid.
+        """
+        
+        reduction = np.asarray(reduction, dtype=float)
+        squeeze = reduction.ndim == 1
+        reduction = np.atleast_2d(reduction)
+        n_bands = reduction.shape[0]
+        n_trans, n_points = self.shape
+        
+        # Weight of transect t in band b at point p, over inside points only
+        inside = ~np.reshape(self.outside, self.shape)
+        coefficient = reduction[:, :, None] * inside[None, :, :]
+        total = coefficient.sum(axis=1, keepdims=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            coefficient = np.where(total > 0, coefficient / total, 0)
+        
+        band, tran, point = np.nonzero(coefficient)
+        combine = sparse.csr_matrix(
+            (coefficient[band, tran, point], (band * n_points + point, tran * n_points + point)),
+            shape=(n_bands * n_points, n_trans * n_points)
+        )
+        
+        outside = (total[:, 0, :] == 0).ravel()
+        shape = (n_points,) if squeeze else (n_bands, n_points)
+        
+        return TransectOperator((combine @ self.matrix).tocsr(), outside, shape)
+        
+    def apply(self, data, skipna=False):
+        """
+        Interpolate an array whose last two axes are (latitude, longitude).
+        
+        With skipna, missing grid values are left out and the weights of the
+        remaining values renormalised, by applying the operator to the valid
+        mask as well. Otherwise any missing neighbour makes a point missing,
+        which for a reduced operator means the whole along coast mean.
+        """
+        
+        leading = data.shape[:-2]
+        flat = data.reshape(-1, data.shape[-2] * data.shape[-1])
+        
+        if skipna:
+            valid = ~np.isnan(flat)
+            total = np.asarray(self.matrix.dot(np.where(valid, flat, 0).T).T)
+            weight = np.asarray(self.matrix.dot(valid.T.astype(np.float64)).T)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                tran = np.where(weight > 0, total / weight, np.nan)
+        else:
+            tran = np.asarray(self.matrix.dot(flat.T).T)
+        tran[:, self.outside] = np.nan
+        
+        return tran.reshape(leading + self.shape)
+
+def operator_key(longitude, latitude, point_lon, point_lat):
+    """
+    Hash a source grid and a set of transect points.
+    """
+    
+    h = hashlib.sha1()
+    for a in [longitude, latitude, point_lon, point_lat]:
+        a = np.ascontiguousarray(a, dtype=float)
+        h.update(str(a.shape).encode())
+        h.update(a.tobytes())
+        
+    return h.hexdigest()
+
+def get_operator(longitude, latitude, point_lon, point_lat, cache_dir=None):
+    """
+    Return the transect operator for a grid and geometry, building it only if it is not cached.
+    """
+    
+    key = operator_key(longitude, latitude, point_lon, point_lat)
+    if key in _operators:
+        return _operators[key]
+    
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, 'transect_operator_{}.npz'.format(key))
+        
+    if path is not None and os.path.exists(path):
+        with instrument.stage('load_operator'):
+            operator = TransectOperator.load(path)
+    else:
+        with instrument.stage('build_operator'):
+            operator = TransectOperator.build(longitude, latitude, point_lon, point_lat)
+        if path is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = path[:-len('.npz')] + '.{}.tmp.npz'.format(os.getpid())
+            operator.save(tmp_path)
+            os.replace(tmp_path, path)
+            
+    _operators[key] = operator
+    
+    return operator
+
+def static_key(region, static_path=STATIC_PATH):
+    """
+    Hash a static file and the latitude and longitude bounds of a region.
+    """
+    
+    bounds = [region[dim].start for dim in ['latitude', 'longitude']] \
+        + [region[dim].stop for dim in ['latitude', 'longitude']]
+    
+    h = hashlib.sha1(os.path.abspath(static_path).encode())
+    h.update(np.array(bounds, dtype=float).tobytes())
+    
+    return h.hexdigest()
+
+def load_static(region=COAST_REGION, cache_dir=None, static_path=STATIC_PATH):
+    """
+    Return the static landmask, terrain height and coordinates of a region.
+    
+    With a cache_dir the fields are saved once as .npy files and then memory
+    mapped read only, so parallel workers share one copy in the page cache
+    instead of each reading and subsetting the static file.
+    """
+    
+    if cache_dir is None:
+        return xr.open_dataset(static_path)[STATIC_VARIABLES].sel(**region).squeeze(drop=True).load()
+    
+    directory = os.path.join(cache_dir, 'static_{}'.format(static_key(region, static_path)))
+    
+    if not os.path.exists(directory):
+        static = xr.open_dataset(static_path)[STATIC_VARIABLES].sel(**region)
+        tmp_dir = directory + '.{}.tmp'.format(os.getpid())
+        os.makedirs(tmp_dir, exist_ok=True)
+        for name in STATIC_VARIABLES + ['latitude', 'longitude']:
+            np.save(os.path.join(tmp_dir, name + '.npy'), static[name].values.squeeze())
+        try:
+            os.replace(tmp_dir, directory)
+        except OSError:
+            # Another process finished the same cache first
+            shutil.rmtree(tmp_dir)
+    
+    def load(name):
+        return np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+    
+    coords = {'latitude' : load('latitude'), 'longitude' : load('longitude')}
+    
+    return xr.Dataset(
+        {name : (('latitude', 'longitude'), load(name)) for name in STATIC_VARIABLES}, coords=coords
+    )
+
+def transect_points(trans_lon0, trans_lat0, trans_lon1, trans_lat1, n_points):
+    """
+    Calculate (coastal_axis, transect_axis) arrays of transect point coordinates.
+    """
+    
+    point_lon = np.linspace(trans_lon0, trans_lon1, num=n_points, axis=-1)
+    point_lat = np.linspace(trans_lat0, trans_lat1, num=n_points, axis=-1)
+    
+    return point_lon, point_lat
+
+def apply_transect_operator(ds, operator, dims=('coastal_axis', 'transect_axis'), skipna=False):
+    """
+    Apply a transect operator to every variable with latitude and longitude dimensions.
+    
+    dims names the output dimensions, one per axis of the operator shape.
+    skipna is passed to TransectOperator.apply.
+    """
+    
+    if isinstance(ds, xr.Dataset):
+        tran = {
+            name : apply_transect_operator(da, operator, dims, skipna) for name, da in ds.data_vars.items()
+            if 'latitude' in da.dims and 'longitude' in da.dims
+        }
+        return xr.Dataset(tran, attrs=ds.attrs)
+    
+    # Each dask block must hold the whole horizontal grid
+    if ds.chunks is not None:
+        ds = ds.chunk({'latitude' : -1, 'longitude' : -1})
+    
+    tran = xr.apply_ufunc(
+        operator.apply, ds, 
+        kwargs={'skipna' : skipna},
+        input_core_dims=[['latitude', 'longitude']],
+        output_core_dims=[list(dims)],
+        dask='parallelized',
+        output_dtypes=[np.result_type(ds.dtype, np.float64)],
+        dask_gufunc_kwargs={'output_sizes' : dict(zip(dims, operator.shape))},
+        keep_attrs=True
+    )
+    
+    return tran.transpose(dims[0], ...)
+
+def calc_transects(
+    ds, trans_lon0, trans_lat0, trans_lon1, trans_lat1, n_points, n_trans, cache_dir=None
+):
     """
     Create a new dataset by interpolating over multiple transects.
+    
+    All transects are sampled with one sparse matrix product. The operator is
+    reused for every later call on the same grid and geometry, and is also
+    stored in cache_dir when one is given.
+    
+    Dask backed inputs stay lazy and are processed block by block, so opening
+    files with small time chunks (e.g. TIME_CHUNK) and writing the result with
+    to_netcdf bounds memory by the chunk size rather than the record length.
+    """
+    
+    point_lon, point_lat = transect_points(
+        trans_lon0[:n_trans], trans_lat0[:n_trans], trans_lon1[:n_trans], trans_lat1[:n_trans], n_points
+    )
+    operator = get_operator(
+        ds.longitude.values, ds.latitude.values, point_lon, point_lat, cache_dir=cache_dir
+    )
+    
+    return apply_transect_operator(ds, operator)
+        
+def stack_operators(operators):
+    """
+    Combine operators for several transect families into one operator over all their points.
+    
+    Each family is a block of rows of the combined matrix, so one sparse
+    product per source block samples every family.
+    """
+    
+    matrix = sparse.vstack([operator.matrix for operator in operators]).tocsr()
+    outside = np.concatenate([np.ravel(operator.outside) for operator in operators])
+    
+    return TransectOperator(matrix, outside, (matrix.shape[0],))
+
+def _split_families(data, operator, shapes, skipna=False):
+    """
+    Apply a stacked operator and split its output into one (..., n_trans, n_points) array per family.
+    
+    A single family is returned as a bare array, as apply_ufunc expects for one output.
     """
     
-    tran_0 = horizontal_tran_interp(ds, trans_lon0[0], trans_lat0[0], trans_lon1[0], trans_lat1[0], n=n_points)
-    tran_list = [tran_0] * n_trans
+    tran = operator.apply(data, skipna)
+    bounds = np.cumsum([np.prod(shape) for shape in shapes])[:-1]
+    
+    blocks = tuple(
+        block.reshape(data.shape[:-2] + tuple(shape))
+        for block, shape in zip(np.split(tran, bounds, axis=-1), shapes)
+    )
+    
+    return blocks[0] if len(blocks) == 1 else blocks
 
-    for i in range(1,n_trans):
-        tran_list[i] = horizontal_tran_interp(
-            ds, trans_lon0[i], trans_lat0[i], trans_lon1[i], trans_lat1[i], n=n_points
+def apply_family_operators(ds, operators, dims=None, skipna=False):
+    """
+    Interpolate a DataArray or Dataset onto several transect families in one pass.
+    
+    Returns a list with one result per operator, with the output dimensions
+    in dims for each operator, by default coastal_axis and transect_axis, 
+    sized for its family. skipna is passed to TransectOperator.apply.
+    """
+    
+    if dims is None:
+        dims = [('coastal_axis', 'transect_axis')] * len(operators)
+    
+    if isinstance(ds, xr.Dataset):
+        names = [
+            name for name, da in ds.data_vars.items()
+            if 'latitude' in da.dims and 'longitude' in da.dims
+        ]
+        trans = [apply_family_operators(ds[name], operators, dims, skipna) for name in names]
+        return [
+            xr.Dataset({name : tran[i] for name, tran in zip(names, trans)}, attrs=ds.attrs)
+            for i in range(len(operators))
+        ]
+    
+    if ds.chunks is not None:
+        ds = ds.chunk({'latitude' : -1, 'longitude' : -1})
+    
+    stacked = stack_operators(operators)
+    shapes = [operator.shape for operator in operators]
+    
+    # Families may differ in size, so each gets its own dimension names until the split
+    core_dims = [['{}_{}'.format(dim, i) for dim in family_dims] for i, family_dims in enumerate(dims)]
+    sizes = {dim : size for names, shape in zip(core_dims, shapes) for dim, size in zip(names, shape)}
+    
+    trans = xr.apply_ufunc(
+        _split_families, ds,
+        kwargs={'operator' : stacked, 'shapes' : shapes, 'skipna' : skipna},
+        input_core_dims=[['latitude', 'longitude']],
+        output_core_dims=core_dims,
+        dask='parallelized',
+        output_dtypes=[np.result_type(ds.dtype, np.float64)] * len(shapes),
+        dask_gufunc_kwargs={'output_sizes' : sizes},
+        keep_attrs=True
+    )
+    # A single output comes back as a DataArray rather than a tuple
+    if len(shapes) == 1:
+        trans = (trans,)
+    
+    return [
+        tran.rename(dict(zip(names, family_dims))).transpose(family_dims[0], ...)
+        for tran, names, family_dims in zip(trans, core_dims, dims)
+    ]
+
+def calc_transect_families(
+    ds, geometries, cache_dir=None, mode='full', weights=None, bands=None, skipna=False
+):
+    """
+    Interpolate onto several transect families, e.g. different coastlines, sharing one read of ds.
+    
+    geometries maps family names to TransectGeometry objects. Operators are
+    built and cached per family, then stacked, so adding a family costs one
+    more block of matrix rows rather than another pass over the source data.
+    Returns a dict of transects per family with distance coordinates attached.
+    The mode, weights, bands and skipna options are as for
+    TransectGeometry.calc_transects.
+    """
+    
+    operators = []
+    dims = []
+    coords = []
+    for geometry in geometries.values():
+        operator, family_dims, family_coords = geometry.operator(
+            ds, cache_dir, mode, weights=weights, bands=bands
         )
+        operators.append(operator)
+        dims.append(family_dims)
+        coords.append(family_coords)
+    
+    trans = apply_family_operators(ds, operators, dims, skipna)
+    
+    return {
+        family : tran.assign_coords(family_coords)
+        for family, tran, family_coords in zip(geometries, trans, coords)
+    }
 
-    proj_tran = xr.concat(tran_list, dim = 'coastal_axis')
+def _running_mean(x, window, axis):
+    """
+    Centred running mean along an axis from cumulative sums.
+    
+    Windows follow xarray's rolling(center=True) convention and are NaN unless
+    all window values are valid.
+    """
+    
+    x = np.moveaxis(x, axis, -1)
+    valid = ~np.isnan(x)
+    
+    zeros = np.zeros(x.shape[:-1] + (1,))
+    total = np.concatenate([zeros, np.cumsum(np.where(valid, x, 0), axis=-1, dtype=np.float64)], axis=-1)
+    count = np.concatenate([zeros, np.cumsum(valid, axis=-1)], axis=-1)
     
-    return proj_tran 
+    start = window // 2
+    end = window - 1 - start
+    i = np.arange(start, x.shape[-1] - end)
     
+    mean = np.full(x.shape, np.nan)
+    window_total = total[..., i + end + 1] - total[..., i - start]
+    window_count = count[..., i + end + 1] - count[..., i - start]
+    mean[..., i] = np.where(window_count == window, window_total / window, np.nan)
+    
+    return np.moveaxis(mean, -1, axis)
+
+def running_mean(da, window=24, dim='time'):
+    """
+    Centred running mean of a DataArray or Dataset in linear time.
+    
+    Dask backed arrays stay lazy; neighbouring chunks exchange halos of half a
+    window, so the result is exact across chunk and file boundaries.
+    """
+    
+    if isinstance(da, xr.Dataset):
+        return da.map(
+            lambda v: running_mean(v, window, dim) if dim in v.dims else v, keep_attrs=True
+        )
+    
+    axis = da.get_axis_num(dim)
+    data = da.data
+    
+    if da.chunks is not None:
+        depth = window // 2
+        if min(data.chunks[axis]) < depth:
+            data = data.rechunk({axis : max(window, data.chunks[axis][0])})
+        mean = data.map_overlap(
+            _running_mean, depth={axis : depth}, boundary=np.nan, 
+            window=window, axis=axis, dtype=np.float64
+        )
+    else:
+        mean = _running_mean(data, window, axis)
         
+    return da.copy(data=mean)
+
+def contiguous_segments(time):
+    """
+    Split a time axis into slices without gaps larger than the most common step.
+    """
+    
+    time = np.asarray(time)
+    if time.size < 2:
+        return [slice(0, time.size)]
+    
+    step = np.diff(time)
+    values, counts = np.unique(step, return_counts=True)
+    breaks = np.where(step > values[np.argmax(counts)])[0] + 1
+    bounds = np.concatenate([[0], breaks, [time.size]])
+    
+    return [slice(a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+
+def running_anomaly(ds, window=24, dim='time'):
+    """
+    Perturbation from the centred running mean, computed separately over each contiguous stretch of time.
+    
+    Files opened together with open_mfdataset are treated as one series
+    wherever they are consecutive, so no time steps are lost at file edges.
+    Only the ends of each contiguous stretch are NaN.
+    """
+    
+    segments = contiguous_segments(ds[dim].values)
+    anomaly = [
+        ds.isel({dim : s}) - running_mean(ds.isel({dim : s}), window, dim) for s in segments
+    ]
+    
+    if len(anomaly) == 1:
+        return anomaly[0]
+    
+    return xr.concat(anomaly, dim=dim)
+
+def _interp_columns(values, coords, levels):
+    """
+    Linearly interpolate every column of values from coords onto levels along the last axis.
+    
+    Columns are searched together by offsetting each one past the range of the
+    previous, so a single searchsorted over the flattened columns finds every
+    bracketing level. Coords may increase (height) or decrease (pressure) with
+    index. Levels outside a column, and columns with missing coords, are NaN.
+    """
+    
+    shape = values.shape[:-1]
+    n_level = values.shape[-1]
+    values = values.reshape(-1, n_level)
+    coords = np.broadcast_to(coords, shape + (n_level,)).reshape(-1, n_level).astype(np.float64)
+    levels = np.asarray(levels, dtype=np.float64)
+    n_col = values.shape[0]
+    
+    if n_level > 1 and np.nanmean(coords[:, -1] - coords[:, 0]) < 0:
+        coords = coords[:, ::-1]
+        values = values[:, ::-1]
+    
+    missing = np.isnan(coords).any(axis=-1)
+    coords = np.where(missing[:, None], np.arange(n_level), coords)
+    
+    bottom = coords[:, :1]
+    top = coords[:, -1:]
+    outside = (levels < bottom) | (levels > top) | missing[:, None]
+    target = np.clip(levels, bottom, top)
+    
+    low = coords.min()
+    span = coords.max() - low + 1
+    offset = np.arange(n_col)[:, None] * span
+    
+    i = np.searchsorted((coords - low + offset).ravel(), (target - low + offset).ravel())
+    i = i.reshape(n_col, levels.size) - np.arange(n_col)[:, None] * n_level
+    i = np.clip(i, 1, n_level - 1)
+    
+    z0 = np.take_along_axis(coords, i - 1, axis=-1)
+    z1 = np.take_along_axis(coords, i, axis=-1)
+    v0 = np.take_along_axis(values, i - 1, axis=-1)
+    v1 = np.take_along_axis(values, i, axis=-1)
+    
+    dz = np.where(z1 > z0, z1 - z0, 1)
+    weight = np.where(z1 > z0, (target - z0) / dz, 0)
+    result = v0 + weight * (v1 - v0)
+    result[outside] = np.nan
+    
+    return result.astype(np.result_type(values.dtype, np.float32)).reshape(shape + (levels.size,))
+
+def regrid_vertical(ds, coords, levels, dim='level', new_dim='height'):
+    """
+    Interpolate each column of a DataArray or Dataset from model levels onto fixed levels.
+    
+    coords gives the height (or pressure) of every model level in every column,
+    for example geopotential height transects with the same dimensions as ds.
+    Dask backed inputs stay lazy and are regridded block by block; only dim
+    needs to be in one chunk.
+    """
+    
+    levels = np.asarray(levels, dtype=np.float64)
+    
+    if isinstance(ds, xr.Dataset):
+        return ds.map(
+            lambda v: regrid_vertical(v, coords, levels, dim, new_dim) if dim in v.dims else v, 
+            keep_attrs=True
+        )
+    
+    if ds.chunks is not None:
+        ds = ds.chunk({dim : -1})
+    if coords.chunks is not None:
+        coords = coords.chunk({dim : -1})
+    
+    regridded = xr.apply_ufunc(
+        _interp_columns, ds, coords,
+        kwargs={'levels' : levels},
+        input_core_dims=[[dim], [dim]],
+        output_core_dims=[[new_dim]],
+        exclude_dims={dim},
+        dask='parallelized',
+        output_dtypes=[np.result_type(ds.dtype, np.float32)],
+        dask_gufunc_kwargs={'output_sizes' : {new_dim : levels.size}},
+        keep_attrs=True
+    )
+    
+    order = [new_dim if d == dim else d for d in ds.dims]
+    
+    return regridded.assign_coords({new_dim : levels}).transpose(*order)
+
+def _accumulate_lst(values, hours, longitude, n_bins):
+    """
+    Sum and count values of shape (time, point) into (bin, point) local solar time bins.
+    """
+    
+    n_point = values.shape[1]
+    lst = np.mod(hours[:, None] + longitude[None, :] / 15, 24)
+    bins = np.minimum((lst * n_bins / 24).astype(np.int64), n_bins - 1)
+    
+    valid = ~np.isnan(values)
+    index = (bins * n_point + np.arange(n_point))[valid]
+    
+    total = np.bincount(index, weights=values[valid], minlength=n_bins * n_point)
+    count = np.bincount(index, minlength=n_bins * n_point)
+    
+    return total.reshape(n_bins, n_point), count.reshape(n_bins, n_point)
+    
+def lst_composite(ds, longitude, bin_width=1, dim='time'):
+    """
+    Mean of a DataArray or Dataset in local solar time bins of bin_width hours.
+    
+    Local solar time is UTC plus longitude / 15 hours at every point, using
+    longitude broadcast against the non-time dimensions, e.g. 
+    TransectGeometry.longitude or its mean over coastal_axis. Time steps need
+    not be regular. Dask backed inputs are read one time chunk at a time.
+    The lst coordinate holds bin centres, and the number of samples in each 
+    bin is kept as the n_samples coordinate.
+    """
+    
+    if isinstance(ds, xr.Dataset):
+        return ds.map(
+            lambda v: lst_composite(v, longitude, bin_width, dim) if dim in v.dims else v, 
+            keep_attrs=True
+        )
+    
+    n_bins = int(round(24 / bin_width))
+    if not np.isclose(n_bins * bin_width, 24):
+        raise ValueError('bin_width must divide 24 hours.')
+    
+    ds = ds.transpose(dim, ...)
+    template = ds.isel({dim : 0}, drop=True)
+    longitude = longitude.broadcast_like(template).transpose(*template.dims).values.ravel()
+    
+    time = ds[dim].to_index()
+    hours = ((time - time.floor('D')) / np.timedelta64(1, 'h')).values
+    
+    step = ds.chunks[0][0] if ds.chunks is not None else time.size
+    total = 0
+    count = 0
+    for start in range(0, time.size, step):
+        values = ds.isel({dim : slice(start, start + step)}).values.reshape(-1, longitude.size)
+        t, c = _accumulate_lst(values, hours[start:start + step], longitude, n_bins)
+        total = total + t
+        count = count + c
+    
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+    
+    lst = (np.arange(n_bins) + 0.5) * bin_width
+    shape = (n_bins,) + template.shape
+    dims = ('lst',) + template.dims
+    
+    return xr.DataArray(
+        mean.reshape(shape).astype(np.result_type(ds.dtype, np.float32)), dims=dims, 
+        coords=template.coords, name=ds.name, attrs=ds.attrs
+    ).assign_coords(lst=lst, n_samples=(dims, count.reshape(shape)))
+
+def cyclic_view(composite, repeats=3, dim='lst', period=24):
+    """
+    Repeat a diurnal composite over several days without copying, e.g. for Hovmoller plots.
+    
+    The result has a leading cycle dimension whose stride is zero, so every
+    cycle is a read only view of the same memory, and an lst_cyclic 
+    coordinate running from -(repeats // 2) days. Stack cycle and dim to get
+    one continuous axis; that step copies.
+    """
+    
+    composite = composite.transpose(dim, ...)
+    data = np.ascontiguousarray(composite.values)
+    view = np.lib.stride_tricks.as_strided(
+        data, shape=(repeats,) + data.shape, strides=(0,) + data.strides, writeable=False
+    )
+    
+    cycle = np.arange(repeats) - repeats // 2
+    lst = composite[dim].values
+    
+    return xr.DataArray(
+        view, dims=('cycle',) + composite.dims, 
+        coords=composite.coords,
+        name=composite.name, attrs=composite.attrs
+    ).assign_coords(
+        cycle=cycle, lst_cyclic=(('cycle', dim), lst[None, :] + period * cycle[:, None])
+    )
+
+def _is_regular(t, period):
+    """
+    Check whether times are evenly spaced and cover one period.
+    """
+    
+    step = period / t.size
+    
+    return np.allclose(np.diff(t), step) and np.isclose(t[-1] - t[0] + step, period)
+
+def _fit_harmonics(y, t, n_harmonics, period):
+    """
+    Fit a mean and n_harmonics harmonics of period to every column of y, shape (time, column).
+    
+    Returns the mean and the (harmonic, column) cosine and sine coefficients.
+    Regular samples over a whole period use an FFT. Otherwise, or with
+    missing values, each column is fit by least squares to its valid
+    samples, with all normal equations solved together. Columns with fewer
+    valid samples than coefficients are NaN.
+    """
+    
+    omega = 2 * np.pi * np.arange(1, n_harmonics + 1) / period
+    valid = ~np.isnan(y)
+    
+    if _is_regular(t, period) and valid.all() and t.size > 2 * n_harmonics:
+        spectrum = np.fft.rfft(y, axis=0)[1:n_harmonics + 1] * 2 / t.size
+        # Shift the phase reference from the first sample to time zero
+        spectrum = spectrum * np.exp(-1j * omega[:, None] * t[0])
+        return y.mean(axis=0), spectrum.real, -spectrum.imag
+    
+    design = np.concatenate(
+        [np.ones((t.size, 1)), np.cos(np.outer(t, omega)), np.sin(np.outer(t, omega))], axis=1
+    )
+    weights = valid.astype(np.float64)
+    y = np.where(valid, y, 0)
+    
+    normal = np.einsum('tp,tc,tq->cpq', design, weights, design)
+    rhs = np.einsum('tp,tc->cp', design, weights * y)
+    coefficients = np.einsum('cpq,cq->cp', np.linalg.pinv(normal), rhs)
+    coefficients[weights.sum(axis=0) < design.shape[1]] = np.nan
+    
+    return (
+        coefficients[:, 0], 
+        coefficients[:, 1:n_harmonics + 1].T, 
+        coefficients[:, n_harmonics + 1:].T
+    )
+
+def diurnal_harmonics(composite, n_harmonics=3, dim='hour', period=24):
+    """
+    Mean, amplitude and phase of the first n_harmonics diurnal harmonics at every point.
+    
+    phase is the time of the maximum of each harmonic in the units of dim,
+    between 0 and period / harmonic. Hourly composites are analysed with an
+    FFT; irregular times, such as the CSCAT overpass times, by least squares.
+    A Dataset gives {name}_mean, {name}_amplitude and {name}_phase variables.
+    """
+    
+    if isinstance(composite, xr.Dataset):
+        harmonics = [
+            diurnal_harmonics(da, n_harmonics, dim, period).rename(
+                {key : '{}_{}'.format(name, key) for key in ['mean', 'amplitude', 'phase']}
+            )
+            for name, da in composite.data_vars.items() if dim in da.dims
+        ]
+        return xr.merge(harmonics).assign_attrs(composite.attrs)
+    
+    composite = composite.transpose(dim, ...)
+    template = composite.isel({dim : 0}, drop=True)
+    t = composite[dim].values.astype(np.float64)
+    order = np.argsort(t)
+    
+    y = composite.values[order].reshape(t.size, -1).astype(np.float64)
+    mean, cos, sin = _fit_harmonics(y, t[order], n_harmonics, period)
+    
+    harmonic = np.arange(1, n_harmonics + 1)
+    omega = 2 * np.pi * harmonic / period
+    amplitude = np.hypot(cos, sin)
+    phase = np.mod(np.arctan2(sin, cos) / omega[:, None], period / harmonic[:, None])
+    
+    shape = (n_harmonics,) + template.shape
+    dims = ('harmonic',) + template.dims
+    
+    return xr.Dataset(
+        {
+            'mean' : (template.dims, mean.reshape(template.shape)), 
+            'amplitude' : (dims, amplitude.reshape(shape)), 
+            'phase' : (dims, phase.reshape(shape)),
+        },
+        coords=template.coords, attrs={'period' : period, 'time_dimension' : dim}
+    ).assign_coords(harmonic=harmonic)
+
+def reconstruct_harmonics(harmonics, times=None, dim='hour', name=None):
+    """
+    Evaluate harmonics from diurnal_harmonics at times, by default every hour of the period.
+    
+    Give name to reconstruct one variable of harmonics fitted to a Dataset.
+    """
+    
+    prefix = '' if name is None else name + '_'
+    period = harmonics.attrs.get('period', 24)
+    if times is None:
+        times = np.arange(period)
+    times = xr.DataArray(np.asarray(times, dtype=np.float64), dims=dim)
+    times = times.assign_coords({dim : times.values})
+    
+    omega = 2 * np.pi * harmonics.harmonic / period
+    amplitude = harmonics[prefix + 'amplitude']
+    phase = harmonics[prefix + 'phase']
+    
+    cycle = (amplitude * np.cos(omega * (times - phase))).sum('harmonic')
+    
+    return (harmonics[prefix + 'mean'] + cycle).transpose(dim, ...).rename(name)
+
 def define_transects(lon0, lat0, coast_lon1, coast_lat1, distance=500*10**3, spacing = 4*10**3):
     """
     Create a new dataset along transects perpendicular to given line (e.g. coastline). 
@@ -54,9 +841,11 @@ def define_transects(lon0, lat0, coast_lon1, coast_lat1, distance=500*10**3, spa
     p = pp.Geod(ellps='WGS84')
     tran_lon1, tran_lat1 = p.fwd(lon0, lat0, az, distance, radians=False)[0:2]
     
-    # Calculate n_trans and n_points
-    coast_distance = p.inv(lon0, lat0, coast_lon1, coast_lat1)[2]
-    tran_distance = p.inv(lon0, lat0, tran_lon1, tran_lat1)[2]
+    # Calculate n_trans and n_points from both lengths in one call
+    coast_distance, tran_distance = p.inv(
+        np.array([lon0, lon0]), np.array([lat0, lat0]), 
+        np.array([coast_lon1, tran_lon1]), np.array([coast_lat1, tran_lat1])
+    )[2]
     
     # Approximate even spacing in lat and lon by even spacing in km
     n_trans = int(np.floor(coast_distance / spacing) + 1);
@@ -74,3 +863,375 @@ def define_transects(lon0, lat0, coast_lon1, coast_lat1, distance=500*10**3, spa
     tran_distances = np.linspace(0, tran_distance, num=n_points)
         
     return trans_lon0, trans_lat0, trans_lon1, trans_lat1, n_points, n_trans, coast_distances, tran_distances
+
+class TransectGeometry:
+    """
+    Transects perpendicular to a coastline segment, with distances measured from the coast.
+    """
+    
+    _arrays = [
+        'trans_lon0', 'trans_lat0', 'trans_lon1', 'trans_lat1', 'coast_distances', 'tran_distances'
+    ]
+    
+    def __init__(
+        self, params, trans_lon0, trans_lat0, trans_lon1, trans_lat1, 
+        coast_distances, tran_distances, coast_location=0.0
+    ):
+        self.params = tuple(float(x) for x in params)
+        self.trans_lon0 = trans_lon0
+        self.trans_lat0 = trans_lat0
+        self.trans_lon1 = trans_lon1
+        self.trans_lat1 = trans_lat1
+        self.coast_distances = coast_distances
+        self.tran_distances = tran_distances
+        self.coast_location = float(coast_location)
+        self.cache_dir = None
+        self.static_path = STATIC_PATH
+        
+    @property
+    def n_trans(self):
+        return np.size(self.trans_lon0)
+    
+    @property
+    def n_points(self):
+        return np.size(self.tran_distances)
+    
+    @property
+    def b_lon(self):
+        return self.trans_lon1[0] - self.params[0]
+    
+    @property
+    def b_lat(self):
+        return self.trans_lat1[0] - self.params[1]
+    
+    @property
+    def points(self):
+        """
+        Longitudes and latitudes of every transect point, shape (n_trans, n_points).
+        """
+        return transect_points(
+            self.trans_lon0, self.trans_lat0, self.trans_lon1, self.trans_lat1, self.n_points
+        )
+    
+    @property
+    def longitude(self):
+        """
+        Longitude of every transect point as a (coastal_axis, transect_axis) DataArray.
+        """
+        return xr.DataArray(
+            self.points[0], dims=('coastal_axis', 'transect_axis'),
+            coords={'coastal_axis' : self.coast_distances, 'transect_axis' : self.tran_distances}
+        )
+        
+    @classmethod
+    def from_params(cls, lon0, lat0, coast_lon1, coast_lat1, distance, spacing):
+        """
+        Define transects with distances measured from the start of each transect.
+        """
+        
+        trans_lon0, trans_lat0, trans_lon1, trans_lat1, n_points, n_trans, coast_distances, tran_distances = define_transects(
+            lon0, lat0, coast_lon1, coast_lat1, distance, spacing
+        )
+        
+        return cls(
+            (lon0, lat0, coast_lon1, coast_lat1, distance, spacing),
+            trans_lon0, trans_lat0, trans_lon1, trans_lat1, coast_distances, tran_distances
+        )
+    
+    @classmethod
+    def create(
+        cls, lon0, lat0, coast_lon1, coast_lat1, distance=500*10**3, spacing=4*10**3, 
+        static_path=STATIC_PATH, cache_dir=None
+    ):
+        """
+        Return the geometry for the given parameters, locating the coast only if it is not cached.
+        
+        The coast is located on the landmask of static_path, so geometries 
+        built from different static files are cached separately.
+        """
+        
+        params = (lon0, lat0, coast_lon1, coast_lat1, distance, spacing)
+        h = hashlib.sha1(np.array(params, dtype=float).tobytes())
+        h.update(os.path.abspath(static_path).encode())
+        key = h.hexdigest()
+        
+        path = None
+        if cache_dir is not None:
+            path = os.path.join(cache_dir, 'transect_geometry_{}.npz'.format(key))
+            
+        if key in _geometries:
+            geometry = _geometries[key]
+        elif path is not None and os.path.exists(path):
+            geometry = cls.load(path)
+        else:
+            with instrument.stage('locate_coast'):
+                geometry = cls.from_params(*params)
+                static = geometry.static_transects(cache_dir, static_path)
+                geometry.locate_coast(static.LANDMASK)
+            if path is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp_path = path[:-len('.npz')] + '.{}.tmp.npz'.format(os.getpid())
+                geometry.save(tmp_path)
+                os.replace(tmp_path, path)
+                
+        geometry.cache_dir = cache_dir
+        geometry.static_path = static_path
+        _geometries[key] = geometry
+        
+        return geometry
+    
+    @classmethod
+    def load(cls, path):
+        """
+        Load a geometry saved with save.
+        """
+        
+        f = np.load(path)
+        
+        return cls(
+            f['params'], *[f[name] for name in cls._arrays], coast_location=f['coast_location']
+        )
+    
+    def save(self, path):
+        """
+        Save the geometry as an npz file.
+        """
+        
+        arrays = {name : getattr(self, name) for name in self._arrays}
+        np.savez(path, params=np.array(self.params), coast_location=self.coast_location, **arrays)
+        
+    def locate_coast(self, landmask):
+        """
+        Shift tran_distances so the coast, where the mean landmask drops below 0.5, is at 0.
+        
+        landmask is the landmask along every transect, as from static_transects.
+        """
+        
+        tran_distances = self.tran_distances + self.coast_location
+        landmask_tran = landmask.mean('coastal_axis')
+        
+        # Calcualate distance where landmask drops below 0.5
+        coast_i = np.where(np.asarray(landmask_tran.values).squeeze() < 0.5)[0][0] - 1
+        self.coast_location = tran_distances[coast_i]
+        self.tran_distances = tran_distances - self.coast_location
+        
+    def static_transects(self, cache_dir=None, static_path=None):
+        """
+        Return the landmask and terrain height along every transect.
+        
+        The static file defaults to the one the geometry was created from.
+        With a cache_dir the transects are saved once as .npy files and then
+        memory mapped read only, so pool workers share one copy.
+        """
+        
+        if cache_dir is None:
+            cache_dir = self.cache_dir
+        if static_path is None:
+            static_path = self.static_path
+        
+        static = load_static(COAST_REGION, cache_dir, static_path)
+        if cache_dir is None:
+            return self.calc_transects(static)
+        
+        # The operator key covers only the grid and points, so add the static file
+        point_lon, point_lat = self.points
+        key = operator_key(static.longitude.values, static.latitude.values, point_lon, point_lat)
+        key = key + '_' + static_key(COAST_REGION, static_path)
+        paths = {
+            name : os.path.join(cache_dir, 'static_transect_{}_{}.npy'.format(key, name)) 
+            for name in STATIC_VARIABLES
+        }
+        
+        if not all(os.path.exists(path) for path in paths.values()):
+            tran = self.calc_transects(static, cache_dir)
+            for name, path in paths.items():
+                tmp_path = path[:-len('.npy')] + '.{}.tmp.npy'.format(os.getpid())
+                np.save(tmp_path, tran[name].values)
+                os.replace(tmp_path, path)
+        
+        dims = ('coastal_axis', 'transect_axis')
+        
+        return xr.Dataset(
+            {name : (dims, np.load(path, mmap_mode='r')) for name, path in paths.items()},
+            coords={'coastal_axis' : self.coast_distances, 'transect_axis' : self.tran_distances}
+        )
+        
+    def coastal_reduction(self, weights=None, bands=None):
+        """
+        Return the (band, transect) weights of along coast means, their dimensions and coordinates.
+        
+        weights gives each transect a weight, equal by default. bands are
+        edges of along coast distance; each band averages the transects with
+        coast distances in [edge, next edge). Without bands there is one mean
+        over the whole coast and no band dimension.
+        """
+        
+        if weights is None:
+            weights = np.ones(self.n_trans)
+        weights = np.asarray(weights, dtype=float)
+        
+        if bands is None:
+            return weights, ('transect_axis',), {'transect_axis' : self.tran_distances}
+        
+        bands = np.asarray(bands, dtype=float)
+        member = (self.coast_distances >= bands[:-1, None]) & (self.coast_distances < bands[1:, None])
+        coords = {'coastal_band' : (bands[:-1] + bands[1:]) / 2, 'transect_axis' : self.tran_distances}
+        
+        return member * weights, ('coastal_band', 'transect_axis'), coords
+    
+    def operator(self, ds, cache_dir=None, mode='full', weights=None, bands=None):
+        """
+        Return the operator for ds in a mode, with its output dimensions and coordinates.
+        """
+        
+        if cache_dir is None:
+            cache_dir = self.cache_dir
+        
+        point_lon, point_lat = self.points
+        operator = get_operator(
+            ds.longitude.values, ds.latitude.values, point_lon, point_lat, cache_dir=cache_dir
+        )
+        
+        if mode == 'full':
+            dims = ('coastal_axis', 'transect_axis')
+            coords = {'coastal_axis' : self.coast_distances, 'transect_axis' : self.tran_distances}
+            return operator, dims, coords
+        if mode == 'coastal_mean':
+            reduction, dims, coords = self.coastal_reduction(weights, bands)
+            return operator.reduce(reduction), dims, coords
+        
+        raise ValueError('Unknown mode {}.'.format(mode))
+    
+    def calc_transects(self, ds, cache_dir=None, mode='full', weights=None, bands=None, skipna=False):
+        """
+        Interpolate onto the transects and attach distance coordinates.
+        
+        In the default full mode the result has coastal_axis and 
+        transect_axis dimensions. In coastal_mean mode the along coast mean 
+        (see coastal_reduction) is folded into the operator, so the 
+        individual transects are never computed or stored. Missing data then
+        make the mean missing unless skipna is set, which leaves out missing
+        grid values and renormalises the weights of the rest, for products
+        with gaps such as CMORPH and TRMM 3B42.
+        """
+        
+        operator, dims, coords = self.operator(ds, cache_dir, mode, weights=weights, bands=bands)
+        
+        tran = apply_transect_operator(ds, operator, dims, skipna)
+        
+        return tran.assign_coords(coords)
+    
+    def project(self, u, v):
+        """
+        Project horizontal wind onto the transect direction.
+        """
+        
+        return (u * self.b_lon + v * self.b_lat) / np.sqrt(self.b_lon ** 2 + self.b_lat ** 2)
+
+class DiurnalAccumulator:
+    """
+    Running hour of day count, mean and sum of squared deviations.
+    
+    Each update reduces one dataset and merges it into the state with the
+    pairwise (Welford / Chan et al.) update, so states built from different
+    files, processes or runs can be merged in any order. The state is held in
+    memory as small (hour, ...) arrays, so each dataset is read only once.
+    """
+    
+    def __init__(self, count=None, mean=None, m2=None, sources=None):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.sources = list(sources or [])
+        
+    @classmethod
+    def from_dataset(cls, ds, source=None):
+        """
+        Reduce a dataset with a time dimension to an accumulator.
+        """
+        
+        hours = np.arange(24)
+        
+        count = ds.notnull().groupby('time.hour').sum('time')
+        mean = ds.groupby('time.hour').mean('time')
+        m2 = ((ds.groupby('time.hour') - mean) ** 2).groupby('time.hour').sum('time')
+        
+        count = count.reindex(hour=hours, fill_value=0)
+        mean = mean.reindex(hour=hours).where(count > 0, 0)
+        m2 = m2.reindex(hour=hours, fill_value=0)
+        
+        # Compute together so the shared reads of ds happen in one pass
+        count, mean, m2 = dask.compute(count, mean, m2)
+        
+        return cls(count, mean, m2, [source] if source is not None else [])
+    
+    def merge(self, other):
+        """
+        Combine the states of two accumulators.
+        """
+        
+        if self.count is None:
+            return DiurnalAccumulator(other.count, other.mean, other.m2, self.sources + other.sources)
+        if other.count is None:
+            return DiurnalAccumulator(self.count, self.mean, self.m2, self.sources + other.sources)
+        
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        frac = (other.count / count).where(count > 0, 0)
+        
+        mean = self.mean + delta * frac
+        m2 = self.m2 + other.m2 + delta ** 2 * self.count * frac
+        
+        return DiurnalAccumulator(count, mean, m2, self.sources + other.sources)
+    
+    def update(self, ds, source=None):
+        """
+        Add a dataset with a time dimension to the state.
+        """
+        
+        merged = self.merge(DiurnalAccumulator.from_dataset(ds, source))
+        self.count, self.mean, self.m2, self.sources = merged.count, merged.mean, merged.m2, merged.sources
+        
+        return self
+    
+    def composite(self):
+        """
+        Return the hour of day mean.
+        """
+        
+        return self.mean.where(self.count > 0)
+    
+    def variance(self, ddof=1):
+        """
+        Return the hour of day variance.
+        """
+        
+        return (self.m2 / (self.count - ddof)).where(self.count > ddof)
+    
+    def save(self, path):
+        """
+        Save the state to a netCDF file.
+        """
+        
+        state = xr.concat([self.count, self.mean, self.m2], dim='statistic')
+        state = state.assign_coords(statistic=['count', 'mean', 'm2'])
+        state.attrs['sources'] = '\n'.join(self.sources)
+        
+        tmp_path = path + '.{}.tmp'.format(os.getpid())
+        state.to_netcdf(path=tmp_path, mode='w', format='NETCDF4')
+        os.replace(tmp_path, path)
+        
+    @classmethod
+    def load(cls, path):
+        """
+        Load a state saved with save.
+        """
+        
+        state = xr.open_dataset(path).load()
+        sources = [s for s in state.attrs.get('sources', '').split('\n') if s]
+        state.attrs = {}
+        
+        return cls(
+            *[state.sel(statistic=s).drop('statistic') for s in ['count', 'mean', 'm2']], 
+            sources=sources
+        )